@@ -2,15 +2,17 @@
 # main.py or aidungeon/__main__.py (updated for Ollama)
 
 import sys
-import os
 from pathlib import Path
 
 # Add the project directory to the path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from aidungeon.getconfig import logger
+from aidungeon.getconfig import logger, get_ollama_host
 from aidungeon.utils import output, clear_lines, use_ptoolkit, input_number, list_items
 from aidungeon.ollamagenerator import get_generator
+from aidungeon.transport import get_transport
+from aidungeon.discovery import Discovery
+from aidungeon.background import GenerationCancelled
 from aidungeon.play import GameManager
 
 def main():
@@ -28,12 +30,11 @@ def main():
            "or email cloveranon@nuke.africa for bug reports, help, and feature requests.",
            'subsubtitle', end="\n\n")
     
-    # Check if Ollama is available
+    # Check if Ollama is available. The model list fetched here (or a recent cached
+    # copy of it) is reused by the generator instead of asking the server again.
+    discovery = Discovery(get_transport(get_ollama_host()))
     try:
-        import requests
-        ollama_host = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
-        response = requests.get(f"{ollama_host}/api/tags", timeout=5)
-        response.raise_for_status()
+        discovery.models()
     except Exception as e:
         output("Error: Cannot connect to Ollama server!", "error")
         output("Make sure Ollama is running with: ollama serve", "message")
@@ -48,9 +49,11 @@ def main():
     
     # Initialize the generator
     try:
-        generator = get_generator()
+        generator = get_generator(discovery)
         output(f"Successfully connected to Ollama model: {generator.model_name}", "message")
         output("")
+        # Load the model while the player is still in the menus
+        generator.start_warm_up()
     except Exception as e:
         output(f"Failed to initialize Ollama generator: {e}", "error")
         return 1
@@ -75,7 +78,7 @@ def main():
                 break
             # Otherwise continue the loop for another adventure
             
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, GenerationCancelled):
         output("\nGoodbye! Thanks for playing AI Dungeon!", "message")
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
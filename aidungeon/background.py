@@ -0,0 +1,178 @@
+# aidungeon/background.py
+import contextlib
+import contextvars
+import threading
+from typing import Any, Callable, Optional
+from .getconfig import logger
+
+
+class BackgroundJob:
+    """
+    Runs a function on a daemon worker thread on behalf of one story state.
+    `key` identifies that state (see Story.state_key); callers compare it with
+    the current state and discard or cancel the job once the story moved on.
+    Generations the function starts pick up the job's cancellation token (see
+    current_token), so cancelling the job also stops them on the server.
+    """
+
+    def __init__(self, key: str, fn: Callable, *args, name: str = "background", **kwargs):
+        self.key = key
+        self.name = name
+        self.result = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.token = CancellationToken()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, args=(fn, args, kwargs), name=name, daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, fn, args, kwargs):
+        _current_token.set(self.token)
+        try:
+            self.result = fn(*args, **kwargs)
+        except GenerationCancelled as e:
+            self.error = e
+            logger.debug(f"Background {self.name} job was cancelled.")
+        except Exception as e:
+            self.error = e
+            logger.warning(f"Background {self.name} job failed: {e}")
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._invoke(callback)
+
+    def _invoke(self, callback: Callable[["BackgroundJob"], Any]):
+        if self.cancelled.is_set():
+            return
+        try:
+            callback(self)
+        except Exception as e:
+            logger.warning(f"Background {self.name} callback failed: {e}")
+
+    def add_done_callback(self, callback: Callable[["BackgroundJob"], Any]):
+        """Call `callback(job)` from the worker once it finishes, or now if it already has."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._invoke(callback)
+
+    def cancel(self):
+        """Mark the job as abandoned and abort its requests; its result and callbacks will be ignored."""
+        self.cancelled.set()
+        self.token.cancel()
+
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        """Block until the job finishes and return its result (None if it failed or was cancelled)."""
+        self._done.wait(timeout)
+        if self.cancelled.is_set() or self.error is not None:
+            return None
+        return self.result
+
+    def is_current(self, key: str) -> bool:
+        return not self.cancelled.is_set() and self.key == key
+
+
+class GenerationCancelled(Exception):
+    """Raised by a request whose CancellationToken was cancelled."""
+
+
+class CancellationToken:
+    """
+    Lets one thread abort requests another thread has in flight. Streaming
+    responses register themselves; cancel() closes them, which drops the
+    connection so Ollama stops generating for a client that is gone.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._responses = set()
+        self._children = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def child(self) -> "CancellationToken":
+        """A token that can be cancelled on its own, and is cancelled along with this one."""
+        token = CancellationToken()
+        with self._lock:
+            if not self._event.is_set():
+                self._children.append(token)
+                return token
+        token.cancel()
+        return token
+
+    def cancel(self) -> int:
+        """Cancel, closing any open responses. Returns how many there were."""
+        with self._lock:
+            self._event.set()
+            responses, self._responses = self._responses, set()
+            children, self._children = self._children, []
+        for child in children:
+            child.cancel()
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+        return len(responses)
+
+    def register(self, response):
+        """Track a response so cancel() can close it. Raises if already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._responses.add(response)
+                return
+        response.close()
+        raise GenerationCancelled()
+
+    def unregister(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise GenerationCancelled()
+
+
+_current_token = contextvars.ContextVar("cancellation_token", default=None)
+
+
+def current_token() -> Optional[CancellationToken]:
+    """The cancellation token of the BackgroundJob running this code, if any."""
+    return _current_token.get()
+
+
+def with_current_token(fn: Callable, token: Optional[CancellationToken] = None) -> Callable:
+    """
+    Wrap `fn` to run under `token`, by default the caller's cancellation token, for
+    handing work to a thread pool from inside a BackgroundJob.
+    """
+    if token is None:
+        token = current_token()
+
+    def run(*args, **kwargs):
+        with using_token(token):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+@contextlib.contextmanager
+def using_token(token: Optional[CancellationToken]):
+    """Make `token` the current cancellation token for the duration of the block."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
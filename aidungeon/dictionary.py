@@ -127,8 +127,8 @@ adjective_action_d20 = [
 palette_commands = [
     '/revert', '/quit', '/exit', '/menu', '/retry', '/restart', '/print', '/sheet',
     '/look', '/drop', '/alter', '/altergen', '/context', '/remember',
-    '/memalt', '/memswap', '/roll', '/forget', '/save', '/load',
-    '/summarize', '/generate', '/help', '/set', '/settings', '/suggest',
+    '/memalt', '/memswap', '/roll', '/forget', '/pin', '/save', '/load',
+    '/summarize', '/generate', '/help', '/set', '/settings', '/suggest', '/status',
     # Add dice shortcuts as commands too
     '/d4', '/d6', '/d8', '/d10', '/d12', '/d20', '/d100'
 ]
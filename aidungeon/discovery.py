@@ -0,0 +1,90 @@
+# aidungeon/discovery.py
+import json
+import time
+from pathlib import Path
+from typing import List, Optional
+from .getconfig import settings, logger
+from .modelinfo import ModelInfo, ModelInfoCache
+from .transport import OllamaTransport
+
+DISCOVERY_FILE = Path(".cache", "discovery.json")
+
+
+class Discovery:
+    """
+    Everything startup needs to know about an Ollama server, fetched once and shared
+    by __main__, get_generator and OllamaGenerator: the installed models (/api/tags)
+    and the chosen model's details (/api/show).
+
+    The model list is also kept on disk for `ttl` seconds so a quick restart doesn't
+    need any round-trip before the first menu; model details are cached by digest
+    in ModelInfoCache and never expire.
+    """
+
+    def __init__(self, transport: OllamaTransport, ttl: Optional[int] = None, path: Path = DISCOVERY_FILE):
+        self.transport = transport
+        self.ttl = ttl if ttl is not None else settings.getint("discovery-cache-ttl", 300)
+        self.path = path
+        self._models = None
+        self._model_info = {}
+        self._model_info_cache = ModelInfoCache()
+
+    def _load_cached_models(self) -> Optional[list]:
+        if self.ttl <= 0:
+            return None
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if cached.get("host") != self.transport.ollama_host or time.time() - cached.get("time", 0) > self.ttl:
+            return None
+        logger.debug("Using cached Ollama model list.")
+        return cached.get("models")
+
+    def _save_cached_models(self, models: list):
+        if self.ttl <= 0:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("w", encoding="utf-8") as f:
+                json.dump({"host": self.transport.ollama_host, "time": time.time(), "models": models}, f)
+        except IOError as e:
+            logger.warning(f"Could not write discovery cache {self.path}: {e}")
+
+    def models(self, refresh: bool = False) -> List[dict]:
+        """
+        The /api/tags model list. Raises requests.exceptions.RequestException if the
+        server can't be reached and there is no fresh cached copy.
+        """
+        if self._models is None and not refresh:
+            self._models = self._load_cached_models()
+        if self._models is None or refresh:
+            response = self.transport.get("/api/tags")
+            response.raise_for_status()
+            self._models = response.json().get('models', [])
+            self._save_cached_models(self._models)
+        return self._models
+
+    def model_names(self) -> List[str]:
+        return [model['name'] for model in self.models()]
+
+    def digest(self, model_name: str) -> Optional[str]:
+        return next((model.get('digest') for model in self.models() if model['name'] == model_name), None)
+
+    def model_info(self, model_name: str) -> ModelInfo:
+        """
+        The context window details for a model. Raises requests.exceptions.RequestException
+        (or ValueError for a malformed reply) if /api/show had to be called and failed.
+        """
+        if model_name in self._model_info:
+            return self._model_info[model_name]
+        digest = self.digest(model_name)
+        info = self._model_info_cache.get(digest)
+        if info is None:
+            response = self.transport.post("/api/show", json={"name": model_name})
+            response.raise_for_status()
+            info = ModelInfo.from_show(response.json())
+            self._model_info_cache.put(digest, info)
+        self._model_info[model_name] = info
+        return info
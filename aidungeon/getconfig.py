@@ -41,6 +41,12 @@ setting_info = {
     "console-bell":     ["Beep after AI generates text.", "on"],
     "top-keks":         ["Number of words the AI can randomly choose.", 20],
     "action-sugg":      ["How many actions to generate; 0 is off.", 4],
+    "suggestion-mode":  ["json asks for all suggestions in one request; parallel makes one request each.", "json"],
+    "suggestion-workers":["How many suggestions may be generated at the same time.", 3],
+    "summary-workers":  ["How many summaries may be generated at the same time when loading a long save.", 3],
+    "speculate":        ["Pre-generate the story for the top suggestions while you decide.", "off"],
+    "speculate-k":      ["How many suggestions to pre-generate when speculate is on.", 2],
+    "retry-pool":       ["Alternative results kept ready in the background for /retry; 0 is off.", 0],
     "action-d20":       ["Makes actions difficult.", "on"],
     "action-temp":      ["How random the suggested actions are.", 1],
     "prompt-toolkit":   ["Whether or not to use the prompt_toolkit library.", "on"],
@@ -48,11 +54,34 @@ setting_info = {
     "generate-num":     ["Approximate number of tokens to generate.", 60],
     "top-p":            ["Changes nucleus sampling threshold.", 0.9],
     "log-level":        ["Development log level. <30 is for developers.", 30],
+    "stream-output":    ["Show the AI's text while it is being generated.", "on"],
+    "memory-tokens":    ["Tokens of /remember entries sent per prompt, most relevant first (pinned always go); 0 sends all.", 256],
+    "recall":           ["Bring back relevant turns that were summarized away (needs NumPy and an embedding model).", "off"],
+    "recall-model":     ["Ollama embedding model used by recall.", "nomic-embed-text"],
+    "recall-k":         ["How many earlier turns recall adds to each prompt.", 3],
+    "reuse-context":    ["Continue Ollama's cached conversation instead of resending the story.", "on"],
     "clear-suggestions":["Clears the suggestion list after you make a choice.", "on"],
     # Ollama-specific settings
-    "ollama-host":      ["Ollama server URL.", "http://localhost:11434"],
+    "ollama-host":      ["Ollama server URL, or several separated by commas to spread load over them.", "http://localhost:11434"],
+    "ollama-health-interval":["Seconds between health checks when several Ollama hosts are set.", 15],
+    "ollama-host-max-in-flight":["Requests a host runs before a story's turns overflow to another; 0 is no limit.", 4],
     "ollama-model":     ["Default Ollama model to use.", "llama2:7b"],
-    "ollama-timeout":   ["Timeout for Ollama requests in seconds.", 120],
+    "ollama-timeout":   ["Longest a whole generation may take, in seconds.", 120],
+    "ollama-connect-timeout":["Seconds to wait for a connection to Ollama.", 5],
+    "ollama-first-token-timeout":["Seconds to wait for the first token, including loading the model.", 90],
+    "keep-alive":       ["How long Ollama keeps the model loaded between requests (e.g. 30m, -1 forever).", "30m"],
+    "max-num-ctx":      ["Largest context window (num_ctx) to ask Ollama for.", 8192],
+    "discovery-cache-ttl":["Seconds to reuse the cached Ollama model list at startup; 0 is off.", 300],
+    "hedge":            ["Duplicate a story turn to a second host when it is slow to start (needs several hosts).", False],
+    "hedge-percentile": ["Recent first-token latency percentile after which a turn is hedged.", 95],
+    "best-of":          ["Story turns sampled at once per attempt, keeping the first usable one; 1 is off.", 1],
+    "retry-attempts":   ["Most attempts at a story turn that came back empty or failed.", 6],
+    "retry-budget":     ["Seconds a story turn may spend retrying before giving up.", 60],
+    "circuit-threshold":["Failed requests in a row before pausing requests to Ollama.", 3],
+    "circuit-reset":    ["Seconds to pause requests once Ollama looks down.", 30],
+    "ollama-pool-size": ["Number of host connection pools kept alive.", 2],
+    "ollama-pool-maxsize":["Maximum open connections per Ollama host.", 8],
+    "ollama-retries":   ["Retries for failed connections to Ollama.", 2],
 }
 
 # Add Ollama-specific environment variable support
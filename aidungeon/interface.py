@@ -29,10 +29,12 @@ def instructions():
     print('  "/memswap"               Swaps places of two memory entries')
     print('  "/roll"                  Rolls one or more dice (3d6, 2d4, 1d20, etc).')
     print('  "/forget"                Opens a menu allowing you to remove permanent memories')
+    print('  "/pin"                   Choose memories that are sent with every prompt, however relevant')
     print('  "/save"                  Saves your game to a file in the game\'s save directory')
     print('  "/load"                  Loads a game from a file in the game\'s save directory')
     print('  "/summarize"             Create a new story using by summarizing your previous one')
     print('  "/generate"              Continues the story and generates new suggestions.')
+    print('  "/status"                Shows the AI model, whether it is loaded, and its context window')
     print('  "/help"                  Prints these instructions again')
     print('  "/set [SETTING] [VALUE]" Sets the specified setting to the specified value.:')
     for k, v in setting_info.items():
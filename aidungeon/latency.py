@@ -0,0 +1,35 @@
+# aidungeon/latency.py
+import threading
+from collections import deque
+from typing import Optional
+
+
+class LatencyTracker:
+    """
+    A window of recent latency samples (in seconds) for one kind of request,
+    so a timeout can be set relative to what is normal for this setup instead
+    of guessed up front.
+    """
+
+    # Below this many samples a percentile says more about luck than the server
+    MIN_SAMPLES = 10
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """The given percentile of recent samples, or None if there are too few yet."""
+        with self._lock:
+            if len(self.samples) < self.MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+        return ordered[index]
@@ -0,0 +1,99 @@
+# aidungeon/memoryrank.py
+import math
+import re
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List
+
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def terms(text: str) -> List[str]:
+    """Lowercased words, without the very short ones that match almost everything."""
+    return [word.strip("'") for word in WORD.findall(text.lower()) if len(word.strip("'")) > 2]
+
+
+class MemoryRanker:
+    """
+    Scores a story's /remember entries against what is happening now with BM25, so
+    only the relevant ones need to go into the prompt. The inverted index is kept
+    per story and updated by sync(): only added or changed entries are tokenized,
+    and removed ones are dropped from their postings.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        # memory text -> its term counts, and term -> {memory text: count}
+        self.docs: Dict[str, Counter] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def _add(self, text: str):
+        counts = Counter(terms(text))
+        self.docs[text] = counts
+        self.total_length += sum(counts.values())
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[text] = count
+
+    def _remove(self, text: str):
+        counts = self.docs.pop(text)
+        self.total_length -= sum(counts.values())
+        for term in counts:
+            posting = self.postings[term]
+            del posting[text]
+            if not posting:
+                del self.postings[term]
+
+    def sync(self, memories: Iterable[str]):
+        """Bring the index in line with the current memory entries."""
+        current = set(memories)
+        for text in [text for text in self.docs if text not in current]:
+            self._remove(text)
+        for text in current:
+            if text not in self.docs:
+                self._add(text)
+
+    def scores(self, query: str) -> Dict[str, float]:
+        """BM25 score of every indexed entry sharing a term with `query`."""
+        if not self.docs:
+            return {}
+        count = len(self.docs)
+        average = self.total_length / count or 1
+        scores = {}
+        for term in set(terms(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for text, tf in posting.items():
+                length = sum(self.docs[text].values())
+                norm = tf + self.K1 * (1 - self.B + self.B * length / average)
+                scores[text] = scores.get(text, 0.0) + idf * tf * (self.K1 + 1) / norm
+        return scores
+
+    def select(self, memories: List[str], query: str, allowance: int,
+               count_tokens: Callable[[str], int], pinned: Iterable[str] = ()) -> List[str]:
+        """
+        The entries to send with a prompt, in their original order. Pinned entries are
+        always kept; the rest are taken best score first (newest first among equals)
+        while they fit in `allowance` tokens. An allowance of 0 or less keeps everything.
+        """
+        if allowance <= 0:
+            return list(memories)
+        with self._lock:
+            self.sync(memories)
+            scores = self.scores(query)
+        pinned = set(pinned)
+        chosen = {i for i, text in enumerate(memories) if text in pinned}
+        remaining = allowance - sum(count_tokens(memories[i]) for i in chosen)
+        ranked = sorted((i for i in range(len(memories)) if i not in chosen),
+                        key=lambda i: (scores.get(memories[i], 0.0), i), reverse=True)
+        for i in ranked:
+            cost = count_tokens(memories[i])
+            if cost <= remaining:
+                chosen.add(i)
+                remaining -= cost
+        return [text for i, text in enumerate(memories) if i in chosen]
@@ -0,0 +1,90 @@
+# aidungeon/modelinfo.py
+import json
+import re
+from pathlib import Path
+from typing import Optional
+from .getconfig import logger
+
+CACHE_FILE = Path(".cache", "models.json")
+
+# The window Ollama uses when neither the request nor the modelfile sets num_ctx
+DEFAULT_NUM_CTX = 2048
+
+
+class ModelInfo:
+    """The context window details /api/show reports for a model."""
+
+    def __init__(self, context_length: Optional[int] = None, num_ctx: Optional[int] = None):
+        # What the model was trained for, from model_info.<arch>.context_length
+        self.context_length = context_length
+        # What the modelfile configures with PARAMETER num_ctx, if anything
+        self.num_ctx = num_ctx
+
+    @property
+    def effective_context(self) -> int:
+        """The window Ollama will actually give a request that doesn't set num_ctx."""
+        window = self.num_ctx or DEFAULT_NUM_CTX
+        if self.context_length:
+            window = min(window, self.context_length)
+        return window
+
+    def to_dict(self):
+        return {"context_length": self.context_length, "num_ctx": self.num_ctx}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d.get("context_length"), d.get("num_ctx"))
+
+    @classmethod
+    def from_show(cls, data: dict) -> "ModelInfo":
+        """Parse an /api/show response."""
+        context_length = None
+        for key, value in (data.get("model_info") or {}).items():
+            if key.endswith(".context_length") and isinstance(value, int):
+                context_length = value
+                break
+
+        num_ctx = None
+        # "parameters" is the modelfile's PARAMETER lines without the keyword
+        for text, pattern in ((data.get("parameters", ""), r"^\s*num_ctx\s+(\d+)"),
+                              (data.get("modelfile", ""), r"^\s*PARAMETER\s+num_ctx\s+(\d+)")):
+            match = re.search(pattern, text or "", flags=re.M | re.I)
+            if match:
+                num_ctx = int(match.group(1))
+                break
+
+        return cls(context_length, num_ctx)
+
+
+class ModelInfoCache:
+    """
+    On-disk cache of ModelInfo keyed by model digest. A digest changes whenever the
+    model is re-pulled or rebuilt, so entries never go stale.
+    """
+
+    def __init__(self, path: Path = CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (IOError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable model cache {self.path}: {e}")
+
+    def get(self, digest: Optional[str]) -> Optional[ModelInfo]:
+        if not digest or digest not in self.entries:
+            return None
+        return ModelInfo.from_dict(self.entries[digest])
+
+    def put(self, digest: Optional[str], info: ModelInfo):
+        if not digest:
+            return
+        self.entries[digest] = info.to_dict()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1)
+        except IOError as e:
+            logger.warning(f"Could not write model cache {self.path}: {e}")
@@ -1,11 +1,55 @@
 # aidungeon/ollamagenerator.py
 import requests
 import json
+import atexit
+import random
+import threading
 import re
-from typing import Union, Optional, List
+import sys
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union, Optional, List, Callable
 from pathlib import Path
 from .getconfig import settings, logger, get_ollama_model, get_ollama_host
-from .utils import cut_trailing_sentence, output, clear_lines, format_result, use_ptoolkit
+from .utils import cut_trailing_sentence, output, clear_lines, count_rows, format_result, use_ptoolkit
+from .transport import OllamaTransport, get_transport
+from .modelinfo import DEFAULT_NUM_CTX
+from .discovery import Discovery
+from .tokens import TokenEstimator
+from .latency import LatencyTracker
+from .background import BackgroundJob, CancellationToken, GenerationCancelled, current_token, using_token
+from .retry import OllamaTransportError, CircuitOpenError, RetryPolicy, get_retry_policy, get_circuit_breaker
+
+# Context window sizes requests may ask for. Every change of num_ctx makes Ollama
+# reload the model, so the window only moves between a few fixed steps and never shrinks.
+NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+class OllamaStreamError(requests.exceptions.RequestException):
+    """Ollama reported an error in the middle of a streamed reply."""
+
+
+class PromptContext:
+    """
+    The encoded conversation Ollama hands back from /api/generate.
+    Sending `tokens` with a request makes the server continue from that state
+    instead of evaluating the whole prompt again; `returned` holds the state
+    after the request so the next turn can continue from it in turn, and `text`
+    the raw text that state ends with. `memory` is for the caller to record which
+    memory entries the conversation's prompt was built with.
+    """
+
+    def __init__(self, tokens: Optional[List[int]] = None, memory: Optional[List[str]] = None):
+        self.tokens = tokens
+        self.memory = memory
+        self.returned = None
+        self.text = None
+
+    def adopt(self, other: "PromptContext"):
+        """Take over the outcome of a request that was made with a copy of this context."""
+        self.returned = other.returned
+        self.text = other.text
 
 class OllamaGenerator:
     """
@@ -23,13 +67,18 @@ class OllamaGenerator:
             top_p: float = 0.9,
             repetition_penalty: float = 1.0,
             repetition_penalty_range: int = 512,
-            repetition_penalty_slope: float = 3.33
+            repetition_penalty_slope: float = 3.33,
+            transport: Optional[OllamaTransport] = None,
+            discovery: Optional[Discovery] = None
     ):
         """
         Initialize the Ollama generator.
         """
         self.model_name = model_name
         self.ollama_host = ollama_host.rstrip('/')
+        self.transport = transport if transport is not None else get_transport(self.ollama_host)
+        self.transport.require_model(model_name)
+        self.discovery = discovery if discovery is not None else Discovery(self.transport)
         self.generate_num = generate_num
         self.temp = temperature
         self.top_k = top_k
@@ -37,22 +86,40 @@ class OllamaGenerator:
         self.repetition_penalty = repetition_penalty
         self.repetition_penalty_range = repetition_penalty_range
         self.repetition_penalty_slope = repetition_penalty_slope
+        self.model_digest = None
+        self.model_info = None
+        self.token_estimator = TokenEstimator(model_name)
+        self._token_counts = {}
+        self._token_counts_version = self.token_estimator.version
+        atexit.register(self.token_estimator.flush)
+        self._num_ctx_lock = threading.Lock()
+        self.keep_alive = settings.get("keep-alive", "30m")
+        self.retry_policy = get_retry_policy()
+        self.circuit_breaker = get_circuit_breaker()
+        self.warm_up_job = None
+        # Time to first token of streamed requests, which is what hedging measures
+        self.first_token_latency = LatencyTracker()
         
         self._validate_setup()
+
+        # Start from the window the server would load anyway, and allow growing up to
+        # the model's trained length or the configured cap, whichever is smaller.
+        default_context = self._get_context_length()
+        trained = self.model_info.context_length if self.model_info else None
+        self.max_context = min(settings.getint("max-num-ctx", 8192), trained or default_context)
+        self.max_context = max(self.max_context, default_context)
+        self.num_ctx = self._bucket_for(default_context)
         
-        self.max_history_tokens = self._get_context_length() - generate_num
+        self.max_history_tokens = self.max_context - generate_num
         
         logger.info(f"Initialized OllamaGenerator with model: {model_name}")
-        logger.info(f"Max token history: {self.max_history_tokens}")
+        logger.info(f"Max token history: {self.max_history_tokens}, starting num_ctx: {self.num_ctx}")
     
     def _validate_setup(self):
         """Validate Ollama connection and model availability."""
         try:
-            response = requests.get(f"{self.ollama_host}/api/tags", timeout=10)
-            response.raise_for_status()
-            
-            models = response.json().get('models', [])
-            available_models = [model['name'] for model in models]
+            available_models = self.discovery.model_names()
+            self.model_digest = self.discovery.digest(self.model_name)
             
             if self.model_name not in available_models:
                 logger.warning(f"Model {self.model_name} not found. Available models: {available_models}")
@@ -66,114 +133,383 @@ class OllamaGenerator:
             raise ConnectionError(f"Cannot connect to Ollama server at {self.ollama_host}")
     
     def _get_context_length(self) -> int:
-        """Get the context length for the current model."""
+        """
+        Get the context window requests to the current model will get.
+        Discovery caches the answer on disk by model digest, so restarts skip /api/show.
+        """
+        try:
+            info = self.discovery.model_info(self.model_name)
+        except (requests.exceptions.RequestException, ValueError):
+            logger.warning("Could not determine model context length, using default")
+            return DEFAULT_NUM_CTX
+
+        self.model_info = info
+        logger.info(f"Model context: trained={info.context_length}, num_ctx={info.num_ctx}, "
+                    f"using {info.effective_context}")
+        return info.effective_context
+
+    def warm_up(self) -> bool:
+        """
+        Load the model into memory with the session's num_ctx, so the first story turn
+        doesn't pay for it. A generate request without a prompt only loads the model.
+        With several hosts every one of them loads it, in parallel.
+        """
+        hosts = self.transport.hosts()
+        if len(hosts) == 1:
+            return self._warm_up_host(hosts[0])
+        with ThreadPoolExecutor(max_workers=len(hosts), thread_name_prefix="warm-up") as pool:
+            return any(list(pool.map(self._warm_up_host, hosts)))
+
+    def _warm_up_host(self, transport: OllamaTransport) -> bool:
+        request_data = {"model": self.model_name, "options": {"num_ctx": self.num_ctx}}
+        if self.keep_alive:
+            request_data["keep_alive"] = self.keep_alive
+        try:
+            response = transport.post("/api/generate", json=request_data)
+            response.raise_for_status()
+            logger.info(f"Model {self.model_name} is loaded on {transport.ollama_host}.")
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not preload {self.model_name} on {transport.ollama_host}: {e}")
+            return False
+
+    def start_warm_up(self):
+        """Preload the model on a background thread while menus are on screen."""
+        if self.warm_up_job is None:
+            self.warm_up_job = BackgroundJob("warm-up", self.warm_up, name="warm-up")
+        return self.warm_up_job
+
+    def model_status(self) -> dict:
+        """What /api/ps says about this model: whether it is resident, and until when."""
+        status = {"resident": False}
+        try:
+            response = self.transport.get("/api/ps")
+            response.raise_for_status()
+            for model in response.json().get('models', []):
+                if model.get('name') == self.model_name or model.get('model') == self.model_name:
+                    status.update(resident=True, expires_at=model.get('expires_at'),
+                                  size_vram=model.get('size_vram'), size=model.get('size'))
+                    break
+        except (requests.exceptions.RequestException, ValueError) as e:
+            status["error"] = str(e)
+        return status
+
+    def embed(self, texts: List[str], model_name: str, session: Optional[str] = None) -> List[List[float]]:
+        """
+        Embeddings for `texts` from /api/embed, in one request. Raises
+        OllamaTransportError if the request fails.
+        """
         try:
-            response = requests.post(
-                f"{self.ollama_host}/api/show",
-                json={"name": self.model_name},
-                timeout=10
+            response = self.transport.post(
+                "/api/embed",
+                json={"model": model_name, "input": texts, "keep_alive": self.keep_alive},
+                session=session,
             )
             response.raise_for_status()
-            model_info = response.json()
-            
-            context_length = model_info.get('modelfile', '').find('num_ctx')
-            if context_length == -1:
-                if 'llama2' in self.model_name.lower():
-                    return 4096
-                elif 'mistral' in self.model_name.lower():
-                    return 8192
-                elif 'codellama' in self.model_name.lower():
-                    return 16384
-                else:
-                    return 2048
-            
-            return 4096
-            
-        except requests.exceptions.RequestException:
-            logger.warning("Could not determine model context length, using default")
-            return 2048
-    
-    def _build_prompt(self, context: str, memory: List[str], story: str, action: str) -> str:
+            return response.json()["embeddings"]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            raise OllamaTransportError(f"Embedding with {model_name} failed: {e}") from e
+
+    def _bucket_for(self, tokens: int) -> int:
+        """The smallest window bucket holding `tokens`, capped at max_context."""
+        for bucket in NUM_CTX_BUCKETS:
+            if bucket >= tokens:
+                return min(bucket, self.max_context)
+        return self.max_context
+
+    def _select_num_ctx(self, needed: int) -> int:
+        """
+        The num_ctx to send for a request needing `needed` tokens.
+        The session keeps one value and only steps it up when a request no longer fits.
         """
-        Build the complete prompt for the model.
+        with self._num_ctx_lock:
+            if needed > self.num_ctx and self.num_ctx < self.max_context:
+                bucket = self._bucket_for(needed)
+                logger.info(f"Prompt needs ~{needed} tokens; raising num_ctx from {self.num_ctx} "
+                               f"to {bucket}. Ollama will reload {self.model_name}.")
+                self.num_ctx = bucket
+            return self.num_ctx
+
+    def estimate_tokens(self, text: str) -> int:
+        """Token count for text, from the model's calibrated characters-per-token ratio."""
+        return self.token_estimator.estimate_tokens(text)
+
+    def count_tokens(self, text: str) -> int:
+        """estimate_tokens, remembered per text so story turns are only measured once."""
+        if self._token_counts_version != self.token_estimator.version:
+            # The ratio moved noticeably, so the remembered counts are off
+            self._token_counts = {}
+            self._token_counts_version = self.token_estimator.version
+        count = self._token_counts.get(text)
+        if count is None:
+            if len(self._token_counts) > 4096:
+                self._token_counts.clear()
+            count = self._token_counts[text] = self.estimate_tokens(text)
+        return count
+
+    def _trim_to_tokens(self, text: str, tokens: int) -> str:
+        """Keep the end of text, cut at a word boundary, so it fits in about `tokens`."""
+        cost = self.estimate_tokens(text)
+        if cost <= tokens:
+            return text
+        if tokens <= 0:
+            return ""
+        text = text[-(len(text) * tokens // cost):]
+        words = text.split(' ', 1)
+        return words[1].strip() if len(words) > 1 else text.strip()
+
+    def fit_passages(self, passages: List[str], reserved: int = 0) -> List[str]:
+        """
+        Shorten the longest passages until all of them fit in max_history_tokens less
+        `reserved`, e.g. the story turns sent to be summarized. Passages shorter than
+        an even share of the budget are kept whole.
+        """
+        budget = self.max_history_tokens - reserved
+        costs = [self.count_tokens(passage) + 1 for passage in passages]
+        if sum(costs) <= budget:
+            return list(passages)
+        remaining, left = budget, len(passages)
+        for cost in sorted(costs):
+            if cost > remaining // left:
+                break
+            remaining -= cost
+            left -= 1
+        share = remaining // left - 1
+        return [passage if cost - 1 <= share else self._trim_to_tokens(passage, share)
+                for passage, cost in zip(passages, costs)]
+
+    def build_prompt(self, context: str, memory: List[str], turns: List[str], action: str,
+                     system: str = '') -> str:
         """
+        Build the complete prompt for the model within max_history_tokens.
+        The system prompt is always kept. Context and memory follow and may take at
+        most half of what is left; the rest is filled with the most recent turns,
+        newest first, then the action.
+        """
+        budget = self.max_history_tokens - self.estimate_tokens(system)
         memory_text = ' '.join(memory) if memory else ''
         full_context = f"{context} {memory_text}".strip()
-        
+        full_context = self._trim_to_tokens(full_context, budget // 2)
+        if system:
+            full_context = f"{system}\n\n{full_context}"
+        action = self._trim_to_tokens(action, budget // 4)
+
+        remaining = budget - self.estimate_tokens(full_context) - self.estimate_tokens(action)
+        kept = []
+        for turn in reversed(turns):
+            cost = self.count_tokens(turn) + 1
+            if cost > remaining:
+                break
+            kept.append(turn)
+            remaining -= cost
+        if len(kept) < len(turns):
+            logger.debug(f"Prompt budget fits the last {len(kept)} of {len(turns)} story entries.")
+
+        story = '\n\n'.join(reversed(kept))
         if story.strip():
-            prompt = f"{full_context}\n\n{story}\n{action}"
-        else:
-            prompt = f"{full_context}\n{action}"
-        
-        max_chars = self.max_history_tokens * 4
-        if len(prompt) > max_chars:
-            context_len = len(full_context)
-            if context_len < max_chars // 2:
-                available_for_story = max_chars - context_len - len(action) - 10
-                if available_for_story > 0:
-                    story_truncated = story[-available_for_story:].strip()
-                    sentences = story_truncated.split('. ')
-                    if len(sentences) > 1:
-                        story_truncated = '. '.join(sentences[1:])
-                    prompt = f"{full_context}\n\n{story_truncated}\n{action}"
-                else:
-                    prompt = f"{full_context}\n{action}"
-            else:
-                context_truncated = full_context[-max_chars//2:].strip()
-                prompt = f"{context_truncated}\n{action}"
-        
-        return prompt
+            return f"{full_context}\n\n{story}\n\n{action}".strip()
+        return f"{full_context}\n{action}".strip()
     
     def _call_ollama(self, prompt: str, temperature: float, top_k: int, top_p: float, 
                     repetition_penalty: float, stop_tokens: Optional[List[str]] = None,
-                    num_predict: Optional[int] = None) -> str:
-        """Make a generation request to Ollama."""
+                    num_predict: Optional[int] = None, stream: bool = False,
+                    context: Optional[PromptContext] = None, quiet: bool = False,
+                    format: Optional[dict] = None, seed: Optional[int] = None,
+                    timeout: Optional[float] = None, cancel: Optional[CancellationToken] = None,
+                    session: Optional[str] = None, hedge: bool = False,
+                    first_token: Optional[threading.Event] = None) -> str:
+        """
+        Make a generation request to Ollama.
+        Raises OllamaTransportError if the request fails or runs out of time, or
+        CircuitOpenError without sending anything while the circuit breaker considers
+        the server down. `timeout` can only shorten the configured total timeout.
+
+        The reply is always streamed, so the first-token timeout can be applied and
+        cancelling (through `cancel`, the running BackgroundJob's token, or Ctrl-C)
+        can cut it off mid-generation, which stops the model on the server too; the
+        call then raises GenerationCancelled.
+        `session` keeps a story's requests on the same host when there are several;
+        `hedge` marks a backup copy of a stalled request, to be sent elsewhere.
+        `first_token` is set once the first streamed token has arrived.
+        """
         
         # Use the provided num_predict, or fall back to the class default
         final_num_predict = num_predict if num_predict is not None else self.generate_num
 
+        # Streamed tokens are only rendered where the preview can be erased afterwards.
+        # Quiet calls (e.g. from worker threads) never draw anything.
+        render = stream and use_ptoolkit() and not quiet
+        show_progress = use_ptoolkit() and not quiet and not render
+        if cancel is None:
+            cancel = current_token() or CancellationToken()
+
+        needed = self.estimate_tokens(prompt) + final_num_predict
+        if context is not None and context.tokens:
+            needed += len(context.tokens)
+
         request_data = {
             "model": self.model_name,
             "prompt": prompt,
-            "stream": False,
+            "stream": True,
             "options": {
                 "temperature": temperature,
                 "top_k": top_k,
                 "top_p": top_p,
                 "repeat_penalty": repetition_penalty,
                 "num_predict": final_num_predict,
+                "num_ctx": self._select_num_ctx(needed),
             }
         }
         
         if stop_tokens:
             request_data["options"]["stop"] = stop_tokens
+
+        if seed is not None:
+            request_data["options"]["seed"] = seed
+
+        if self.keep_alive:
+            request_data["keep_alive"] = self.keep_alive
+
+        if context is not None and context.tokens:
+            request_data["context"] = context.tokens
+
+        # A JSON schema makes Ollama constrain the output to match it
+        if format:
+            request_data["format"] = format
         
+        # A pool routes around a dead host by itself; the breaker is for when none are left
+        if not self.transport.can_fail_over() and not self.circuit_breaker.allow():
+            raise CircuitOpenError(f"Ollama at {self.ollama_host} is not responding")
+
+        timeouts = self.transport.timeouts
+        started = time.monotonic()
+        deadline = started + (min(timeout, timeouts.total) if timeout else timeouts.total)
+
+        def on_first_token():
+            self.first_token_latency.record(time.monotonic() - started)
+            if first_token is not None:
+                first_token.set()
+
+        clines = 0
+        settled = False
         try:
-            if use_ptoolkit():
+            if show_progress:
                 clines = output("Generating...", "loading-message")
-            
-            response = requests.post(
-                f"{self.ollama_host}/api/generate",
-                json=request_data,
-                timeout=120
-            )
+            # The token can abort the request while it waits for headers, too
+            with using_token(cancel):
+                response = self.transport.post(
+                    "/api/generate",
+                    json=request_data,
+                    timeout=timeouts.for_request(deadline - started),
+                    stream=True,
+                    session=session,
+                    hedge=hedge
+                )
+            if not response.ok:
+                # Nobody will read this stream; hand its connection back before raising
+                response.close()
             response.raise_for_status()
-            
-            if use_ptoolkit():
-                clear_lines(clines)
-            
-            result = response.json()
-            generated_text = result.get('response', '')
-            
-            logger.debug(f"Generated text: {repr(generated_text)}")
-            return generated_text
-            
-        except requests.exceptions.RequestException as e:
+            result = self._consume_stream(response, render=render, cancel=cancel,
+                                          on_first_token=on_first_token, deadline=deadline)
+        except GenerationCancelled:
+            raise
+        except KeyboardInterrupt:
+            # Drop the connection so the server stops generating for nobody
+            cancel.cancel()
+            raise GenerationCancelled() from None
+        except Exception as e:
+            if cancel.cancelled:
+                # Closing the response from another thread surfaces as whatever
+                # error the reading thread happens to run into
+                raise GenerationCancelled() from e
+            if not isinstance(e, (requests.exceptions.RequestException, json.JSONDecodeError)):
+                raise
+            self.circuit_breaker.record_failure()
+            settled = True
             logger.error(f"Ollama generation failed: {e}")
-            return ""
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse Ollama response: {e}")
-            return ""
+            raise OllamaTransportError(str(e)) from e
+        else:
+            self.circuit_breaker.record_success()
+            settled = True
+        finally:
+            clear_lines(clines)
+            if not settled:
+                # Cancelled or failed some other way: don't hold the probe slot forever
+                self.circuit_breaker.abandon()
+
+        generated_text = result.get('response', '')
+        if context is not None:
+            context.returned = result.get('context')
+            context.text = generated_text
+        self._calibrate(prompt, generated_text, result, continued=bool(request_data.get("context")))
+
+        logger.debug(f"Generated text: {repr(generated_text)}")
+        return generated_text
+
+    def _calibrate(self, prompt: str, generated_text: str, result: dict, continued: bool):
+        """Teach the token estimator from the counts Ollama reports for a finished request."""
+        self.token_estimator.observe(len(generated_text), result.get('eval_count'))
+        prompt_tokens = result.get('prompt_eval_count')
+        # Continued contexts and server-side prefix caching make Ollama count only
+        # part of the prompt; those samples would skew the ratio.
+        if continued or not prompt_tokens or prompt_tokens < self.estimate_tokens(prompt) // 2:
+            return
+        self.token_estimator.observe(len(prompt), prompt_tokens)
+
+    def _consume_stream(self, response: requests.Response, render: bool = True,
+                        cancel: Optional[CancellationToken] = None,
+                        on_first_token: Optional[Callable[[], None]] = None,
+                        deadline: Optional[float] = None) -> dict:
+        """
+        Read Ollama's NDJSON stream, rendering each token as it arrives if asked to.
+        The preview is erased once the stream ends so the caller can print the
+        cleaned up result in its place. Returns the final chunk with the full text
+        as its response, shaped like a non-streamed reply.
+        Raises requests' Timeout once time.monotonic() passes `deadline`, and
+        OllamaStreamError if Ollama reports an error in the stream.
+        """
+        pieces = []
+        result = {}
+        if cancel is not None:
+            cancel.register(response)
+        if render:
+            print()
+        try:
+            for line in response.iter_lines(chunk_size=None):
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise requests.exceptions.Timeout("Generation ran past the total timeout")
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    # A failed request, not empty output: retried with backoff and counted by the breaker
+                    raise OllamaStreamError(f"Ollama stream error: {chunk['error']}")
+                token = chunk.get('response', '')
+                if on_first_token is not None and (token or chunk.get('done')):
+                    on_first_token()
+                    on_first_token = None
+                if token:
+                    pieces.append(token)
+                    if render:
+                        output(token, "ai-text", wrap=False, beg='', end='')
+                        sys.stdout.flush()
+                if chunk.get('done'):
+                    result = chunk
+                    break
+        finally:
+            if cancel is not None:
+                cancel.unregister(response)
+            response.close()
+            generated_text = ''.join(pieces)
+            if render:
+                print()
+                clear_lines(count_rows(generated_text) + 1)
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        result['response'] = generated_text
+        return result
     
     def generate_raw(
             self, 
@@ -186,10 +522,23 @@ class OllamaGenerator:
             repetition_penalty: Optional[float] = None, 
             repetition_penalty_range: Optional[int] = None, 
             repetition_penalty_slope: Optional[float] = None, 
-            stop_tokens: Optional[List[str]] = None
+            stop_tokens: Optional[List[str]] = None,
+            stream: bool = False,
+            prompt_context: Optional[PromptContext] = None,
+            quiet: bool = False,
+            format: Optional[dict] = None,
+            seed: Optional[int] = None,
+            timeout: Optional[float] = None,
+            raise_errors: bool = False,
+            cancel: Optional[CancellationToken] = None,
+            session: Optional[str] = None,
+            hedge: bool = False,
+            first_token: Optional[threading.Event] = None
     ) -> str:
         """
         Generate raw text using Ollama.
+        Pass quiet=True when calling from a worker thread so nothing is drawn.
+        A failed request gives an empty string unless raise_errors is set.
         """
         temperature = temperature if temperature is not None else self.temp
         top_k = top_k if top_k is not None else self.top_k
@@ -201,12 +550,17 @@ class OllamaGenerator:
         logger.debug(f"Sending prompt to Ollama: {repr(full_prompt[:200])}")
         
         # Pass the generate_num override to the call function
-        generated_text = self._call_ollama(
-            full_prompt, temperature, top_k, top_p, repetition_penalty, stop_tokens,
-            num_predict=generate_num
-        )
-        
-        return generated_text
+        try:
+            return self._call_ollama(
+                full_prompt, temperature, top_k, top_p, repetition_penalty, stop_tokens,
+                num_predict=generate_num, stream=stream, context=prompt_context, quiet=quiet,
+                format=format, seed=seed, timeout=timeout, cancel=cancel, session=session,
+                hedge=hedge, first_token=first_token
+            )
+        except OllamaTransportError:
+            if raise_errors:
+                raise
+            return ""
     
     def generate(
             self, 
@@ -218,46 +572,201 @@ class OllamaGenerator:
             repetition_penalty: Optional[float] = None, 
             repetition_penalty_range: Optional[int] = None, 
             repetition_penalty_slope: Optional[float] = None, 
-            depth: int = 0
+            stream: Optional[bool] = None,
+            prompt_context: Optional[PromptContext] = None,
+            quiet: bool = False,
+            retry_policy: Optional[RetryPolicy] = None,
+            accept: Optional[Callable[[str], bool]] = None,
+            best_of: Optional[int] = None,
+            session: Optional[str] = None,
+            cancel: Optional[CancellationToken] = None
     ) -> str:
         """
         Generate and format text for story continuation.
+        When streaming, tokens are shown live and the final text is cleaned up as usual.
+        A prompt_context continues a previous conversation instead of re-evaluating it.
+        Output that is empty or that `accept` rejects (e.g. a repeat of the last turn)
+        is retried according to the retry policy, as are failed requests.
+        With best_of > 1 every attempt samples that many continuations at once with
+        different seeds and keeps the first usable one. Otherwise, with the hedge
+        setting on and several hosts, a request that is slow to start is hedged.
+        Ctrl-C, or cancelling `cancel` (by default the running BackgroundJob's token),
+        aborts everything in flight and raises GenerationCancelled.
         """
+        stream = stream if stream is not None else settings.getboolean("stream-output", True)
+        best_of = best_of if best_of is not None else settings.getint("best-of", 1)
         temperature = temperature if temperature is not None else self.temp
         top_k = top_k if top_k is not None else self.top_k
         top_p = top_p if top_p is not None else self.top_p
         repetition_penalty = repetition_penalty if repetition_penalty is not None else self.repetition_penalty
+        retry = (retry_policy or self.retry_policy).start()
+        cancel = cancel or current_token() or CancellationToken()
         
         logger.debug(f"Generating with temp={temperature}, top_k={top_k}, top_p={top_p}, rep_pen={repetition_penalty}")
-        
-        text = self.generate_raw(
-            context, 
-            prompt, 
-            temperature=temperature, 
-            top_k=top_k, 
-            top_p=top_p, 
-            repetition_penalty=repetition_penalty,
-            stop_tokens=["<|endoftext|>", ">"]
-        )
-        
+
+        try:
+            while True:
+                cancel.raise_if_cancelled()
+                attempt_temperature, seed = retry.policy.perturb(retry.attempt, temperature)
+                sampling = dict(
+                    temperature=attempt_temperature,
+                    top_k=top_k,
+                    top_p=top_p,
+                    repetition_penalty=repetition_penalty,
+                    stop_tokens=["<|endoftext|>", ">"],
+                    raise_errors=True,
+                    session=session
+                )
+                try:
+                    if best_of > 1:
+                        result = self._best_of(context, prompt, best_of, prompt_context, accept, sampling, cancel)
+                    else:
+                        generate_raw = self._generate_hedged if self._should_hedge() else self.generate_raw
+                        text = generate_raw(
+                            context, prompt, stream=stream, prompt_context=prompt_context,
+                            quiet=quiet, seed=seed, cancel=cancel, **sampling
+                        )
+                        result = self._usable_result(text, accept)
+                except OllamaTransportError as e:
+                    if retry.next(RetryPolicy.TRANSPORT, e):
+                        continue
+                    return ""
+
+                if len(result) > 0:
+                    return result
+
+                if not retry.next(RetryPolicy.EMPTY):
+                    logger.warning(f"Model generated no usable text {retry.attempt} times. Consider trying different parameters.")
+                    return ""
+        except KeyboardInterrupt:
+            cancel.cancel()
+            raise GenerationCancelled() from None
+
+    def _should_hedge(self) -> bool:
+        return settings.getboolean("hedge", False) and len(self.transport.hosts()) > 1
+
+    # Hedge delay until enough first-token latencies have been seen to know what's slow
+    HEDGE_DEFAULT_DELAY = 10.0
+    HEDGE_MIN_DELAY = 0.25
+
+    def _hedge_delay(self) -> float:
+        delay = self.first_token_latency.percentile(settings.getfloat("hedge-percentile", 95))
+        if delay is None:
+            return self.HEDGE_DEFAULT_DELAY
+        return max(delay, self.HEDGE_MIN_DELAY)
+
+    def _generate_hedged(self, context: str, prompt: str, stream: bool = False,
+                         prompt_context: Optional[PromptContext] = None, quiet: bool = False,
+                         cancel: Optional[CancellationToken] = None, **kwargs) -> str:
+        """
+        generate_raw with request hedging. If no token has arrived once the request has
+        taken longer than the hedge-percentile of recent first-token latencies, a quiet
+        duplicate goes to another host; whichever finishes first wins and the other is
+        cancelled, as are both when `cancel` is. Raises OllamaTransportError only if both fail.
+        """
+        finished = queue.Queue()
+        tokens = prompt_context.tokens if prompt_context is not None else None
+
+        def attempt(**attempt_kwargs):
+            try:
+                return self.generate_raw(context, prompt, **kwargs, **attempt_kwargs), None
+            except (OllamaTransportError, GenerationCancelled) as e:
+                return None, e
+
+        def launch(name, **attempt_kwargs):
+            request = {"context": PromptContext(tokens), "progress": threading.Event(),
+                       "cancel": cancel.child() if cancel is not None else CancellationToken()}
+            job = BackgroundJob(name, attempt, name=name, prompt_context=request["context"],
+                                cancel=request["cancel"], first_token=request["progress"],
+                                **attempt_kwargs)
+            request["job"] = job
+            job.add_done_callback(lambda job: (request["progress"].set(), finished.put(request)))
+            return request
+
+        primary = launch("request", stream=stream, quiet=quiet)
+        delay = self._hedge_delay()
+        if primary["progress"].wait(delay):
+            requests_left = [primary]
+        else:
+            logger.info(f"No first token after {delay:.1f}s; hedging the request on another host.")
+            requests_left = [primary, launch("hedge", quiet=True, hedge=True)]
+
+        error = None
+        while requests_left:
+            request = finished.get() if len(requests_left) > 1 else requests_left[0]
+            requests_left.remove(request)
+            text, request_error = request["job"].wait() or (None, request["job"].error)
+            if request_error is None:
+                for loser in requests_left:
+                    # One that was already streaming may have drawn a preview;
+                    # let it erase that before the result is shown
+                    if loser["cancel"].cancel():
+                        loser["job"].wait(1.0)
+                if prompt_context is not None:
+                    prompt_context.adopt(request["context"])
+                if request is not primary:
+                    logger.info("The hedged request finished first.")
+                return text
+            if not isinstance(request_error, GenerationCancelled):
+                error = request_error
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        raise error or OllamaTransportError("Hedged request failed")
+
+    def _usable_result(self, text: str, accept: Optional[Callable[[str], bool]] = None) -> str:
+        """Clean up generated text; empty if nothing usable is left or `accept` rejects it."""
         logger.debug(f"Raw generated result: {repr(text)}")
-        
         result = self.result_replace(text)
-        
-        if len(result) == 0 and depth < 6:
+        if len(result) == 0:
             result = self.result_replace(text, allow_action=True)
             logger.info(f"Empty generation, trying with allow_action=True: {repr(result)}")
-        
-        if len(result) == 0 and depth < 20:
-            logger.info(f"Empty generation, retrying (depth={depth})")
-            return self.generate(
-                context, prompt, temperature=temperature, top_p=top_p, top_k=top_k,
-                repetition_penalty=repetition_penalty, depth=depth + 1
-            )
-        elif len(result) == 0:
-            logger.warning(f"Model generated empty text {depth} times. Consider trying different parameters.")
-        
+        if result and accept is not None and not accept(result):
+            logger.info(f"Rejected generation: {repr(result)}")
+            return ""
         return result
+
+    def _best_of(self, context: str, prompt: str, count: int, prompt_context: Optional[PromptContext],
+                 accept: Optional[Callable[[str], bool]], sampling: dict,
+                 cancel: Optional[CancellationToken] = None) -> str:
+        """
+        Sample `count` continuations concurrently with different seeds and return the
+        first usable one, cancelling the others. Returns an empty string if none was
+        usable, or raises OllamaTransportError if every request failed.
+        """
+        cancel = cancel.child() if cancel is not None else CancellationToken()
+        tokens = prompt_context.tokens if prompt_context is not None else None
+        contexts = [PromptContext(tokens) for _ in range(count)]
+        errors = []
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="best-of") as pool:
+            futures = {
+                pool.submit(
+                    self.generate_raw, context, prompt, prompt_context=sample_context, quiet=True,
+                    seed=random.randint(0, 2 ** 31 - 1), cancel=cancel, **sampling
+                ): sample_context
+                for sample_context in contexts
+            }
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = self._usable_result(future.result(), accept)
+                    except GenerationCancelled:
+                        continue
+                    except OllamaTransportError as e:
+                        errors.append(e)
+                        continue
+                    if result:
+                        cancel.cancel()
+                        if prompt_context is not None:
+                            prompt_context.adopt(futures[future])
+                        return result
+            except BaseException:
+                # Don't leave the pool waiting on samples nobody will read
+                cancel.cancel()
+                raise
+        cancel.raise_if_cancelled()
+        if len(errors) == count:
+            raise errors[0]
+        return ""
     
     def result_replace(self, result: str, allow_action: bool = False) -> str:
         """
@@ -280,20 +789,21 @@ class OllamaGenerator:
         return result
 
 
-def get_generator():
+def get_generator(discovery: Optional[Discovery] = None):
     """
     Factory function to create an Ollama generator.
+    Pass the Discovery used for the startup check so the server is only asked once.
     """
     output("\nInitializing Ollama AI Engine!", "loading-message", end="\n\n")
     
-    ollama_host = get_ollama_host()
+    if discovery is None:
+        discovery = Discovery(get_transport(get_ollama_host()))
+    transport = discovery.transport
+    ollama_host = transport.ollama_host
     model_name = None
     
     try:
-        response = requests.get(f"{ollama_host}/api/tags", timeout=10)
-        response.raise_for_status()
-        models_data = response.json()
-        available_models = [model['name'] for model in models_data.get('models', [])]
+        available_models = discovery.model_names()
         
         if not available_models:
             output("No models found in Ollama. Please pull a model first:", "error")
@@ -350,6 +860,8 @@ def get_generator():
             repetition_penalty=settings.getfloat("rep-pen"),
             repetition_penalty_range=settings.getint("rep-pen-range"),
             repetition_penalty_slope=settings.getfloat("rep-pen-slope"),
+            transport=transport,
+            discovery=discovery,
         )
         return generator
         
@@ -375,4 +887,4 @@ def memory_merge(prompt: str, context: str, max_length: int = 2000) -> str:
         else:
             combined = prompt[-max_length:].strip()
     
-    return combined
\ No newline at end of file
+    return combined
@@ -3,11 +3,13 @@ from pathlib import Path
 import os
 import re
 import random
+import threading
 
 from .getconfig import config, setting_info, get_ollama_host, get_ollama_model, logger, settings
 from .storymanager import Story
 from .utils import *
 from .ollamagenerator import OllamaGenerator, get_generator
+from .background import BackgroundJob, GenerationCancelled
 from .interface import instructions
 from .dictionary import KEYWORD_ACTIONS, INVENTORY_SUGGESTIONS
 from .autocomplete import GameCompleter, input_line_with_autocomplete
@@ -306,6 +308,8 @@ def save_story(story, file_override=None, autosave=False):
     with open(finalpath, 'w') as f:
         try:
             f.write(savedata)
+            if story.recall is not None:
+                story.recall.save(Path(finalpath))
             if not autosave:
                 output("Successfully saved to " + savefile, "message")
         except IOError:
@@ -322,6 +326,17 @@ def load_story(f, gen):
             savefile = re.sub(r"^ *saves *[/\\] *(.*) *(?:\.json)?", "\\1", savefile).strip()
             story.savefile = savefile
             story.from_json(file.read())
+            if story.recall is not None:
+                story.recall.load(f)
+            if story.backlog():
+                clines = output(f"Summarizing {story.backlog()} earlier turns...", "loading-message")
+                try:
+                    story.compact(max_workers=settings.getint("summary-workers", 3))
+                except GenerationCancelled:
+                    output("Stopped summarizing; the rest will be summarized as you play.", "message")
+                finally:
+                    clear_lines(clines)
+            story.start_recall_index()
             return story, story.context, story.actions[-1] if len(story.actions) > 0 else ""
         except FileNotFoundError:
             output("Save file not found. ", "error")
@@ -408,6 +423,14 @@ class GameManager:
         self.skip_suggestion_regeneration = False
         self.hide_suggestions_for_next_prompt = False
         self.last_suggestions = []
+        self.suggestion_job = None
+        self.awaiting_input = False
+        # Speculative results for likely next actions, keyed by the formatted action
+        self.speculations = {}
+        self.speculation_lock = threading.Lock()
+        # Alternative continuations of the last action, ready for /retry
+        self.retry_key = None
+        self.retry_jobs = []
         self.completer = None
 
     def _initialize_completer(self):
@@ -418,56 +441,217 @@ class GameManager:
         """Displays suggestions and the input prompt, then returns the user's action."""
         # Use the 'suggestions' argument passed to the function
         if suggestions and not self.hide_suggestions_for_next_prompt:
-            suggestions_text = "".join([f"\n{i}) {s}" for i, s in enumerate(suggestions)])
-            output("Suggested actions: \n" + suggestions_text, "selection-value")
+            self._print_suggestions(suggestions)
         
         bell()
-        
+
+        # Suggestions still being generated are printed above the prompt once they arrive
+        job = self.suggestion_job
+        if job is not None and not job.ready() and use_ptoolkit():
+            from prompt_toolkit.patch_stdout import patch_stdout
+            job.add_done_callback(self._show_prefetched_suggestions)
+            self.awaiting_input = True
+            try:
+                with patch_stdout():
+                    return self._input_action()
+            finally:
+                self.awaiting_input = False
+        return self._input_action()
+
+    def _input_action(self):
         # Use autocomplete-enabled input if available
         if self.completer and use_ptoolkit():
             return input_line_with_autocomplete("\n> ", "main-prompt", default="You ", completer=self.completer)
         else:
             return input_line("\n> ", "main-prompt", default="You ")
-    
 
-    def regenerate_suggestions(self):
-        """Generates a new set of suggestions and stores them in self.last_suggestions."""
+    def _print_suggestions(self, suggestions):
+        suggestions_text = "".join([f"\n{i}) {s}" for i, s in enumerate(suggestions)])
+        output("Suggested actions: \n" + suggestions_text, "selection-value")
+
+    def _build_suggestions(self):
+        """Returns a new set of suggestions for the current story state. Safe to run on a worker thread."""
         total_suggestions_wanted = settings.getint("action-sugg")
         suggested_actions = []
 
-        if total_suggestions_wanted > 0:
-            num_keyword_suggestions = settings.getint("keyword-sugg")
-            inventory_suggestions = self.get_state_based_suggestions()
-            if inventory_suggestions:
-                suggested_actions.append(random.choice(inventory_suggestions))
-
-            if len(suggested_actions) < num_keyword_suggestions:
-                last_result = self.story.results[-1].lower() if self.story.results else ""
-                present_keywords = [k for k in KEYWORD_ACTIONS if k in last_result]
-                random.shuffle(present_keywords)
-
-                for keyword in present_keywords:
-                    keyword_actions = KEYWORD_ACTIONS[keyword][:]
-                    random.shuffle(keyword_actions)
-                    for action in keyword_actions:
-                        if action not in suggested_actions:
-                            suggested_actions.append(action)
-                        if len(suggested_actions) >= num_keyword_suggestions:
-                            break
+        if total_suggestions_wanted <= 0:
+            return []
+
+        num_keyword_suggestions = settings.getint("keyword-sugg")
+        inventory_suggestions = self.get_state_based_suggestions()
+        if inventory_suggestions:
+            suggested_actions.append(random.choice(inventory_suggestions))
+
+        if len(suggested_actions) < num_keyword_suggestions:
+            last_result = self.story.results[-1].lower() if self.story.results else ""
+            present_keywords = [k for k in KEYWORD_ACTIONS if k in last_result]
+            random.shuffle(present_keywords)
+
+            for keyword in present_keywords:
+                keyword_actions = KEYWORD_ACTIONS[keyword][:]
+                random.shuffle(keyword_actions)
+                for action in keyword_actions:
+                    if action not in suggested_actions:
+                        suggested_actions.append(action)
                     if len(suggested_actions) >= num_keyword_suggestions:
                         break
+                if len(suggested_actions) >= num_keyword_suggestions:
+                    break
 
+        num_ai_suggestions = total_suggestions_wanted - len(suggested_actions)
+        if num_ai_suggestions > 0:
+            suggested_actions.extend(self.story.get_suggestions(
+                num_ai_suggestions,
+                previous_suggestions=suggested_actions,
+                max_workers=settings.getint("suggestion-workers", 3),
+                mode=settings.get("suggestion-mode", "json")
+            ))
 
-            num_ai_suggestions = total_suggestions_wanted - len(suggested_actions)
-            if num_ai_suggestions > 0:
-                for _ in range(num_ai_suggestions):
-                    new_suggestion = self.story.get_suggestion(previous_suggestions=suggested_actions)
-                    if new_suggestion and new_suggestion not in suggested_actions:
-                        suggested_actions.append(new_suggestion)
+        return list(dict.fromkeys(suggested_actions))[:total_suggestions_wanted]
 
-            self.last_suggestions = list(dict.fromkeys(suggested_actions))[:total_suggestions_wanted]
-        else:
+    def regenerate_suggestions(self):
+        """Generates a new set of suggestions and stores them in self.last_suggestions."""
+        self._cancel_suggestion_job()
+        clines = 0
+        if settings.getint("action-sugg") > 0 and use_ptoolkit():
+            clines = output("Generating suggestions...", "loading-message")
+        self.last_suggestions = self._build_suggestions()
+        clear_lines(clines)
+        self.speculate(self.last_suggestions)
+
+    def prefetch_suggestions(self):
+        """Start generating suggestions for the current story state on a worker thread."""
+        if settings.getint("action-sugg") <= 0:
             self.last_suggestions = []
+            return
+        key = self.story.state_key()
+        if self.suggestion_job is not None and self.suggestion_job.is_current(key):
+            return
+        self._cancel_suggestion_job()
+        self.last_suggestions = []
+        self.suggestion_job = BackgroundJob(key, self._build_suggestions, name="suggestions")
+        self.suggestion_job.add_done_callback(lambda job: self.speculate(job.result or [], job.key))
+
+    def _cancel_suggestion_job(self):
+        if self.suggestion_job is not None:
+            self.suggestion_job.cancel()
+            self.suggestion_job = None
+
+    def collect_suggestions(self, wait=False):
+        """
+        Adopt prefetched suggestions if they are ready and still match the story.
+        With wait=True, block until the running job finishes.
+        """
+        job = self.suggestion_job
+        if job is None:
+            return
+        if not job.is_current(self.story.state_key()):
+            self._cancel_suggestion_job()
+            return
+        if wait and not job.ready():
+            clines = output("Generating suggestions...", "loading-message") if use_ptoolkit() else 0
+            job.wait()
+            clear_lines(clines)
+        if job.ready():
+            self.last_suggestions = job.wait() or []
+            self.suggestion_job = None
+
+    def speculate(self, suggestions, key=None):
+        """
+        Pre-generate the story's continuation for the first few suggestions while the
+        player is deciding. Picking a suggestion never rolls the d20, so its action
+        text is known exactly in advance. `key` is the story state the suggestions
+        were made for; nothing is started once the story has moved on from it.
+        """
+        if not settings.getboolean("speculate", False) or not self.story:
+            return
+        current = self.story.state_key()
+        if key is not None and key != current:
+            return
+        key = current
+        with self.speculation_lock:
+            self._cancel_speculations()
+            for suggestion in suggestions[:settings.getint("speculate-k", 2)]:
+                action = format_input("You " + suggestion.strip())
+                self.speculations[action] = BackgroundJob(
+                    key, self.story.generate_result, action, quiet=True, name="speculation"
+                )
+
+    def _drop_speculations(self):
+        """Cancel every speculative generation, once the story moves on some other way."""
+        with self.speculation_lock:
+            self._cancel_speculations()
+
+    def _cancel_speculations(self):
+        for job in self.speculations.values():
+            job.cancel()
+        self.speculations = {}
+
+    def take_speculation(self, action):
+        """Return the pre-generated result for `action` if there is one for this story state, dropping the rest."""
+        with self.speculation_lock:
+            job = self.speculations.pop(format_input(action), None)
+            self._cancel_speculations()
+        if job is None or not job.is_current(self.story.state_key()):
+            return None
+        logger.info("Using speculative result for: " + action)
+        return job.wait()
+
+    def prefetch_retries(self):
+        """Generate alternative continuations of the last action in the background so /retry is instant."""
+        count = settings.getint("retry-pool", 0)
+        if count <= 0 or len(self.story.actions) < 2:
+            return
+        base = self.story.branch(drop=1)
+        action = self.story.actions[-1]
+        key = (base.state_key(), action)
+        if key != self.retry_key:
+            self._cancel_retries()
+            self.retry_key = key
+        while len(self.retry_jobs) < count:
+            self.retry_jobs.append(BackgroundJob(key, base.generate_result, action, quiet=True, name="retry"))
+
+    def _cancel_retries(self):
+        for job in self.retry_jobs:
+            job.cancel()
+        self.retry_jobs = []
+        self.retry_key = None
+
+    def take_retry(self):
+        """
+        Pop a pre-generated alternative for the last action, for use after reverting it.
+        Alternatives the loop detector would reject, or that repeat the result being
+        retried, are thrown away. Finished ones are preferred; otherwise this waits for
+        one already in flight. Returns None when nothing usable is left.
+        """
+        base = self.story.branch(drop=1)
+        if self.retry_key != (base.state_key(), self.story.actions[-1]):
+            self._cancel_retries()
+            return None
+        rejected = self.story.results[-1]
+        previous = self.story.results[-2] if len(self.story.results) > 1 else None
+        jobs = sorted(self.retry_jobs, key=lambda job: not job.ready())
+        while jobs:
+            job = jobs.pop(0)
+            self.retry_jobs.remove(job)
+            generated = job.wait()
+            if not generated or not generated[0]:
+                continue
+            result = format_input(generated[0])
+            if result == rejected or (previous and get_similarity(result, previous) > 0.9):
+                logger.debug("Discarding looping retry alternative: " + result)
+                continue
+            return generated
+        return None
+
+    def _show_prefetched_suggestions(self, job):
+        """Worker-thread callback: show suggestions that finished while the player is at the prompt."""
+        if job is not self.suggestion_job or not job.is_current(self.story.state_key()):
+            return
+        self.last_suggestions = job.result or []
+        self.suggestion_job = None
+        if self.awaiting_input and self.last_suggestions and not self.hide_suggestions_for_next_prompt:
+            self._print_suggestions(self.last_suggestions)
 
     def get_state_based_suggestions(self):
         """Parse the last result for keywords and return relevant actions."""
@@ -490,6 +674,30 @@ class GameManager:
         # Return unique actions while preserving order
         return list(dict.fromkeys(found_actions))
 
+    def show_status(self):
+        """Print the model, whether Ollama currently has it loaded, and the context window in use."""
+        gen = self.generator
+        status = gen.model_status()
+        output("--- Status ---", "title", beg="\n")
+        output(f"  Model: {gen.model_name} @ {gen.ollama_host}", "menu")
+        if "error" in status:
+            output(f"  Loaded: unknown ({status['error']})", "error")
+        elif status["resident"]:
+            output(f"  Loaded: yes, until {status.get('expires_at')}", "menu")
+        else:
+            output("  Loaded: no (the next turn will load it)", "menu")
+        if len(gen.transport.hosts()) > 1:
+            for host in gen.transport.status():
+                state = "up" if host["healthy"] else "down"
+                output(f"  Host {host['host']}: {state}, {host['in_flight']} in flight", "menu")
+        output(f"  Keep alive: {gen.keep_alive}", "menu")
+        output(f"  Context window: {gen.num_ctx} (max {gen.max_context})", "menu")
+        output(f"  Chars per token: {gen.token_estimator.chars_per_token:.2f}", "menu")
+        p50, p95 = (gen.first_token_latency.percentile(p) for p in (50, 95))
+        if p50 is not None:
+            output(f"  First token: {p50:.2f}s median, {p95:.2f}s p95", "menu")
+        output("--------------", "title", end="\n")
+
     def init_story(self) -> bool:
         """Initialize the story. Called by play_story."""
         self.story, self.context, self.prompt = None, None, None
@@ -535,7 +743,11 @@ class GameManager:
             else:
                 return False
         elif new_game_option == 3:
-            self.context, self.prompt = generate_random_prompt(self.generator)
+            try:
+                self.context, self.prompt = generate_random_prompt(self.generator)
+            except GenerationCancelled:
+                output("Cancelled.", "message")
+                return False
             if self.context is None:
                 return False
         elif new_game_option == 4:
@@ -557,7 +769,11 @@ class GameManager:
                         break
             instructions()
             output("Generating story...", "loading-message")
-            self.story = new_story(self.generator, self.context, self.prompt)
+            try:
+                self.story = new_story(self.generator, self.context, self.prompt)
+            except GenerationCancelled:
+                output("Cancelled.", "message")
+                return False
             self.story.savefile = auto_file
         else:
             instructions()
@@ -673,6 +889,11 @@ class GameManager:
                 save_story(self.story)
             exit()
 
+        elif command == "status":
+            self.show_status()
+            self.skip_suggestion_regeneration = True
+            self.hide_suggestions_for_next_prompt = True
+
         elif command == "help":
             instructions()
             self.skip_suggestion_regeneration = True
@@ -699,20 +920,27 @@ class GameManager:
                 return False
             else:
                 output("Retrying...", "loading-message")
+                self._drop_speculations()
                 new_action = self.story.actions[-1]
+                # Generate before reverting, so cancelling leaves the story as it was
+                generated = self.take_retry() or self.story.branch(drop=1).generate_result(new_action)
                 self.story.revert()
-                result = self.story.act(new_action)
+                result = self.story.act(new_action, generated=generated)
                 if self.story.is_looping():
                     self.story.revert()
                     output("That action caused the model to start looping. Try something else instead. ",
                            "error")
                     return False
                 self.story.print_last()
+                # Top the pool back up for the next /retry
+                self.prefetch_retries()
 
         elif command == "revert":
             if len(self.story.actions) < 2:
                 output("You can't go back any farther. ", "error")
                 return False
+            self._cancel_retries()
+            self._drop_speculations()
             self.story.revert()
             output("Last action reverted. ", "message")
             self.story.print_last()
@@ -725,6 +953,8 @@ class GameManager:
                 self.story.character.remove_item(item_to_drop)
 
         elif command == "alter":
+            self._cancel_retries()
+            self._drop_speculations()
             self.story.results[-1] = alter_text(self.story.results[-1])
             self.story.print_last()
 
@@ -752,7 +982,11 @@ class GameManager:
                 if i == len(self.story.memory):
                     break
                 else:
+                    old_memory = self.story.memory[i]
                     self.story.memory[i] = alter_text(self.story.memory[i])
+                    if old_memory in self.story.pinned_memory:
+                        self.story.pinned_memory.remove(old_memory)
+                        self.story.pinned_memory.append(self.story.memory[i])
                     if self.story.memory[i] == 0:
                         del self.story.memory[i]
 
@@ -777,8 +1011,23 @@ class GameManager:
                 if i == len(self.story.memory):
                     break
                 else:
+                    if self.story.memory[i] in self.story.pinned_memory:
+                        self.story.pinned_memory.remove(self.story.memory[i])
                     del self.story.memory[i]
 
+        elif command == "pin":
+            while True:
+                output("Select a memory to pin or unpin: ", "menu")
+                list_items([("[pinned] " if memory in self.story.pinned_memory else "") + memory
+                            for memory in self.story.memory] + ["(Finish)"], "menu")
+                i = input_number(len(self.story.memory), default=-1)
+                if i == len(self.story.memory):
+                    break
+                elif self.story.memory[i] in self.story.pinned_memory:
+                    self.story.pinned_memory.remove(self.story.memory[i])
+                else:
+                    self.story.pinned_memory.append(self.story.memory[i])
+
         elif command == "save":
             save_story(self.story)
 
@@ -815,6 +1064,8 @@ class GameManager:
             self.story.savefile = ""
 
         elif command == "altergen":
+            self._cancel_retries()
+            self._drop_speculations()
             result = alter_text(self.story.results[-1])
             self.story.results[-1] = ""
             output("Regenerating result...", "message")
@@ -885,7 +1136,13 @@ class GameManager:
         if action == "":
             output("Continuing...", "message")
 
-        result = self.story.act(action)
+        # Suggestions and /retry alternatives still being written are for the state
+        # this turn replaces; don't let them compete with it for the model
+        self._cancel_suggestion_job()
+        self._cancel_retries()
+        # Takes this action's speculation, if any, and cancels all the others
+        generated = self.take_speculation(action)
+        result = self.story.act(action, generated=generated)
 
         # Check for loops
         if self.story.is_looping():
@@ -893,6 +1150,11 @@ class GameManager:
             output("That action caused the model to start looping. Try something else instead. ",
                    "error")
 
+        # Work on the next suggestions while the result is shown and read
+        self.hide_suggestions_for_next_prompt = False
+        self.prefetch_suggestions()
+        self.prefetch_retries()
+
         pwon, pdied = player_won(result), player_died(result)
         # If the player won or died, ask them if they want to continue.
         if pwon or pdied:
@@ -919,25 +1181,34 @@ class GameManager:
             return
 
         while True:
-            # Generate suggestions if not skipped
+            # Generate suggestions if not skipped; they arrive in the background
             if not self.skip_suggestion_regeneration:
-                self.regenerate_suggestions()
+                self.prefetch_suggestions()
 
             # Reset the flag after checking it
             self.skip_suggestion_regeneration = False
 
+            # A plain input() prompt can't have text printed above it, so wait there
+            self.collect_suggestions(wait=not use_ptoolkit())
+
             # Get user input
             action = self._display_prompt_and_get_action(self.last_suggestions)
 
             # Process user input
             cmd_regex = re.search(r"^(?: *you *)?\/([^ ]+) *(.*)$", action, flags=re.I)
 
-            if cmd_regex:
-                if self.process_command(cmd_regex):
-                    return  # Exit game loop if command returns True
-            else:
-                if self.process_action(action, self.last_suggestions):
-                    return  # Exit game loop if action returns True
+            try:
+                if cmd_regex:
+                    if self.process_command(cmd_regex):
+                        return  # Exit game loop if command returns True
+                else:
+                    if self.process_action(action, self.last_suggestions):
+                        return  # Exit game loop if action returns True
+            except (GenerationCancelled, KeyboardInterrupt):
+                # Ctrl-C while the AI is working: drop that request, not the game
+                output("Cancelled.", "message", beg='\n')
+                self.skip_suggestion_regeneration = False
+                continue
 
             if settings.getboolean("autosave"):
                 save_story(self.story, file_override=self.story.savefile, autosave=True)
\ No newline at end of file
@@ -26,8 +26,23 @@ GENERATE_SUGGESTION_PROMPT = (
         f"Consider the location of the player when creating suggestions and focus on different elements of the room or location."
     )
 
+# Used when all suggestions are requested at once as a JSON list (suggestion-mode = json)
+GENERATE_SUGGESTIONS_PROMPT = (
+        "Based on this scene, provide {count} different, logical, and creative actions the player could take. "
+        "Each action shouldn't be longer than 5 or 6 words and must focus on a different element of the room or location. "
+        "The actions should make sense for the setting (e.g., in a tavern, you might 'talk to the bartender'; in a dungeon, you might 'check for traps'). "
+        "Answer with JSON only, in the form {{\"actions\": [\"...\", \"...\"]}}."
+    )
+
 # This prompt is used on automatic story summarizations to keep the context usage in check
 SUMMARIZATION_PROMPT = (
         f"Concisely summarize the key events, characters, and outcomes from the "
-        f"following story passage in one or two sentences:\n\n---\n\n)"
-    )
\ No newline at end of file
+        f"following story passage in one or two sentences:\n\n---\n\n"
+    )
+
+# Used to roll several summaries up into one as a long story grows
+MERGE_SUMMARIES_PROMPT = (
+        f"The following are summaries of consecutive parts of a story, oldest first. "
+        f"Combine them into one concise summary of two or three sentences that keeps the "
+        f"key events, characters, and outcomes:\n\n---\n\n"
+    )
@@ -0,0 +1,189 @@
+# aidungeon/recall.py
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional
+from .getconfig import settings, logger
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def turn_text(action: str, result: str) -> str:
+    """The passage stored and recalled for one (action, result) turn."""
+    return f"{action}\n{result}".strip()
+
+
+def passage_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class RecallIndex:
+    """
+    Embeddings of story passages, for bringing back turns that have been summarized
+    away. Passages are keyed by their text, so each is embedded once however often it
+    is offered again, and an edited turn simply becomes a new passage.
+
+    On disk the index sits next to the save file: `<save>.recall.vec` holds the
+    normalized float32 vectors back to back and is only ever appended to, and
+    `<save>.recall.keys` holds a header line followed by one key per vector. Loading
+    memory-maps the vectors instead of reading them in.
+
+    Needs NumPy; without it `available` is False and the story plays without recall.
+    """
+
+    available = np is not None
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], model_name: str):
+        self.embed = embed
+        self.model_name = model_name
+        self.dim = None
+        self.keys = []
+        self.rows = {}
+        self._vectors = None
+        self._pending = []
+        self._saved = 0
+        self._path = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _embed(self, texts: List[str]) -> "np.ndarray":
+        vectors = np.asarray(self.embed(texts), dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got shape {vectors.shape}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    def _matrix(self) -> "np.ndarray":
+        """All vectors as one array. Call with the lock held."""
+        if self._pending:
+            parts = ([self._vectors] if self._vectors is not None else []) + self._pending
+            self._vectors = np.concatenate(parts)
+            self._pending = []
+        return self._vectors
+
+    def add(self, texts: List[str]) -> int:
+        """Embed the passages that aren't indexed yet, in one request. Returns how many were added."""
+        with self._lock:
+            new = list(dict.fromkeys(text for text in texts if text and passage_key(text) not in self.rows))
+        if not new:
+            return 0
+        vectors = self._embed(new)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding size changed from {self.dim} to {vectors.shape[1]}")
+            added = 0
+            for text, vector in zip(new, vectors):
+                key = passage_key(text)
+                if key in self.rows:
+                    continue
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+                self._pending.append(vector[None, :])
+                added += 1
+        logger.debug(f"Embedded {added} passages for recall.")
+        return added
+
+    def search(self, query: str, candidates: List[str], k: int = 3) -> List[str]:
+        """
+        The up to `k` candidates most similar to `query`, most similar first. Only
+        candidates already in the index are considered; call add() for the rest.
+        """
+        if k <= 0 or not query.strip() or not candidates:
+            return []
+        with self._lock:
+            indexed = [(self.rows[passage_key(text)], text) for text in dict.fromkeys(candidates)
+                       if passage_key(text) in self.rows]
+        if not indexed:
+            return []
+        query_vector = self._embed([query])[0]
+        with self._lock:
+            matrix = self._matrix()
+        scores = matrix[[row for row, _ in indexed]] @ query_vector
+        best = np.argsort(-scores)[:k]
+        return [indexed[i][1] for i in best]
+
+    @staticmethod
+    def _paths(savefile: Path):
+        return savefile.with_suffix(".recall.vec"), savefile.with_suffix(".recall.keys")
+
+    def load(self, savefile: Path):
+        """Open the index saved next to `savefile`, if there is one for this embedding model."""
+        vec_path, keys_path = self._paths(savefile)
+        try:
+            with keys_path.open("r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                keys = [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return
+        except (IOError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable recall index {keys_path}: {e}")
+            return
+        if header.get("model") != self.model_name:
+            logger.info(f"Recall index {keys_path} was made with {header.get('model')}; rebuilding it.")
+            return
+        dim = header["dim"]
+        try:
+            vectors = np.memmap(vec_path, dtype=np.float32, mode="r")
+        except (IOError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable recall index {vec_path}: {e}")
+            return
+        # A save cut short can leave one file longer than the other
+        count = min(len(keys), len(vectors) // dim)
+        with self._lock:
+            self.dim = dim
+            self.keys = keys[:count]
+            self.rows = {key: row for row, key in enumerate(self.keys)}
+            self._vectors = vectors[:count * dim].reshape(count, dim)
+            self._pending = []
+            self._saved = count
+            # Append to a consistent pair of files; rewrite a mismatched one on the next save
+            self._path = savefile if count == len(keys) else None
+        logger.debug(f"Loaded {count} recall vectors from {vec_path}")
+
+    def save(self, savefile: Path):
+        """Write the index next to `savefile`, appending only what was added since the last save."""
+        with self._lock:
+            if self.dim is None:
+                return
+            matrix = self._matrix()
+            keys = list(self.keys)
+            rewrite = self._path != savefile
+            start = 0 if rewrite else self._saved
+            # Copy, since the vectors may be mapped from the file about to be rewritten
+            rows = np.array(matrix[start:len(keys)])
+        vec_path, keys_path = self._paths(savefile)
+        try:
+            if rewrite:
+                with keys_path.open("w", encoding="utf-8") as f:
+                    f.write(json.dumps({"model": self.model_name, "dim": self.dim}) + "\n")
+            if rewrite or start < len(keys):
+                with vec_path.open("wb" if rewrite else "ab") as f:
+                    f.write(rows.tobytes())
+                with keys_path.open("a", encoding="utf-8") as f:
+                    f.writelines(key + "\n" for key in keys[start:])
+        except IOError as e:
+            logger.warning(f"Could not write recall index {vec_path}: {e}")
+            return
+        with self._lock:
+            self._saved = len(keys)
+            self._path = savefile
+
+
+def get_recall_index(generator) -> Optional[RecallIndex]:
+    """A recall index configured from the settings file, or None when recall is off or can't work."""
+    if not settings.getboolean("recall", False):
+        return None
+    if not RecallIndex.available:
+        logger.warning("The recall setting needs NumPy (pip install numpy); playing without it.")
+        settings["recall"] = "off"
+        return None
+    model_name = settings.get("recall-model", "nomic-embed-text")
+    return RecallIndex(lambda texts: generator.embed(texts, model_name), model_name)
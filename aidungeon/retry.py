@@ -0,0 +1,167 @@
+# aidungeon/retry.py
+import random
+import threading
+import time
+from typing import Optional
+from .getconfig import settings, logger
+
+
+class OllamaTransportError(ConnectionError):
+    """A request to Ollama failed before producing any output (network, timeout, HTTP error)."""
+
+
+class CircuitOpenError(OllamaTransportError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the server looks down. After `failure_threshold` transport
+    failures in a row the circuit opens and requests are refused for `reset_after`
+    seconds; then a single probe is let through, and its outcome closes the
+    circuit again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        # The thread whose request is the probe; requests run on the thread that made them
+        self._probe_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            self._probing = True
+            self._probe_thread = threading.get_ident()
+            return True
+
+    def abandon(self):
+        """
+        A request ended without showing whether Ollama works (e.g. it was cancelled).
+        If it was the probe, the next request may probe instead.
+        """
+        with self._lock:
+            if self._probing and self._probe_thread == threading.get_ident():
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Ollama is responding again; closing the circuit breaker.")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"{self.failures} failed requests in a row; "
+                                   f"pausing requests to Ollama for {self.reset_after:.0f}s.")
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """
+    How generation is retried. Retries stop after `max_attempts` or once
+    `budget` seconds have passed since the first attempt, whichever comes first.
+
+    Empty output means the server works but sampled nothing useful, so it is
+    retried straight away with a new seed and slightly higher temperature.
+    Transport errors back off exponentially (with jitter) instead, since
+    hammering a struggling server only makes it worse.
+    """
+
+    EMPTY = "empty"
+    TRANSPORT = "transport"
+
+    def __init__(
+            self,
+            max_attempts: int = 6,
+            budget: float = 60.0,
+            base_delay: float = 0.5,
+            max_delay: float = 8.0,
+            temperature_step: float = 0.1,
+            max_temperature: float = 1.5
+    ):
+        self.max_attempts = max_attempts
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.temperature_step = temperature_step
+        self.max_temperature = max_temperature
+
+    def start(self) -> "RetryState":
+        return RetryState(self)
+
+    def perturb(self, attempt: int, temperature: float):
+        """The (temperature, seed) to use for an attempt; the first uses the caller's values."""
+        if attempt == 0:
+            return temperature, None
+        temperature = min(temperature + self.temperature_step * attempt, max(self.max_temperature, temperature))
+        return temperature, random.randint(0, 2 ** 31 - 1)
+
+    def delay(self, attempt: int, kind: str) -> float:
+        if kind != self.TRANSPORT:
+            return 0.0
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+
+class RetryState:
+    """One retry loop's progress against a RetryPolicy."""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempt = 0
+        self.deadline = time.monotonic() + policy.budget
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def next(self, kind: str, error: Optional[Exception] = None) -> bool:
+        """
+        Record a failed attempt. Sleeps for the backoff and returns True if another
+        attempt should be made, or returns False when the attempts or budget ran out.
+        """
+        if isinstance(error, CircuitOpenError):
+            logger.warning("Ollama looks unreachable; not retrying.")
+            return False
+        delay = self.policy.delay(self.attempt, kind)
+        self.attempt += 1
+        if self.attempt >= self.policy.max_attempts or self.remaining() < delay:
+            logger.warning(f"Giving up after {self.attempt} attempts ({kind}).")
+            return False
+        logger.info(f"Attempt {self.attempt} failed ({kind}{': ' + str(error) if error else ''}); "
+                    f"retrying in {delay:.1f}s.")
+        time.sleep(delay)
+        return True
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Create a retry policy configured from the settings file."""
+    return RetryPolicy(
+        max_attempts=settings.getint("retry-attempts", 6),
+        budget=settings.getfloat("retry-budget", 60.0),
+    )
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Create a circuit breaker configured from the settings file."""
+    return CircuitBreaker(
+        failure_threshold=settings.getint("circuit-threshold", 3),
+        reset_after=settings.getfloat("circuit-reset", 30.0),
+    )
@@ -1,9 +1,19 @@
 import json
 import re
+import hashlib
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from .getconfig import settings, logger
+from .ollamagenerator import PromptContext
+from .background import BackgroundJob, CancellationToken, GenerationCancelled, current_token, with_current_token
 from .utils import output, format_result, format_input, get_similarity
 from .charactersheet import CharacterSheet
-from .prompts import GENERATE_PASSAGE_PROMPT, GENERATE_SUGGESTION_PROMPT, SUMMARIZATION_PROMPT
+from .memoryrank import MemoryRanker
+from .recall import get_recall_index, turn_text
+from .retry import OllamaTransportError
+from .summaries import Summary, SummaryStack
+from .prompts import GENERATE_PASSAGE_PROMPT, GENERATE_SUGGESTION_PROMPT, GENERATE_SUGGESTIONS_PROMPT, SUMMARIZATION_PROMPT, MERGE_SUMMARIES_PROMPT
 
 
 class Story:
@@ -18,6 +28,9 @@ class Story:
         self.generator = generator
         self.context = context
         self.memory = memory
+        # Memory entries sent with every prompt, however little they match the action
+        self.pinned_memory = []
+        self.memory_ranker = MemoryRanker()
         self.actions = []
         self.results = []
         self.savefile = ""
@@ -25,6 +38,21 @@ class Story:
         # Constants for the summarization feature
         self.SUMMARIZE_THRESHOLD = 10
         self.STORY_CHUNK_SIZE = 8
+        # Summaries of the turns pruned so far; sent after the context in every prompt
+        self.summaries = SummaryStack()
+        # (job, apply) for a summary being written in the background, where
+        # apply(text) folds the finished summary into the story
+        self.pending_summary = None
+        # Ollama's encoded conversation for the last few story states, keyed by
+        # state_key(), with the memory entries its prompt was built with. Any edit
+        # to the story changes the key, so a stale entry is simply never looked up again.
+        self.KV_CACHE_BRANCHES = 4
+        self.kv_contexts = OrderedDict()
+        # Routes this story's requests to the same Ollama host, whose KV cache holds it
+        self.session_id = uuid.uuid4().hex
+        # Embeddings of summarized-away turns to bring back into prompts, if recall is on
+        self.recall = get_recall_index(generator)
+        self.recall_job = None
 
     def find_and_update_inventory(self, text):
         """Parses text to find items acquired by the player."""
@@ -35,54 +63,288 @@ class Story:
             if item_name:
                 self.character.add_item(item_name)
 
-    def summarize_chunk(self):
-        """Summarizes the oldest chunk of the story and prepends it to the context."""
-        logger.info("Attempting to summarize story chunk...")
-        chunk_actions = self.actions[:self.STORY_CHUNK_SIZE]
-        chunk_results = self.results[:self.STORY_CHUNK_SIZE]
-        story_chunk_text = "\n\n".join([val for pair in zip(chunk_actions, chunk_results) for val in pair])
-        prompt = (
-            SUMMARIZATION_PROMPT + "{story_chunk_text}"
-        )
-        summary = self.generator.generate_raw(
-            prompt,
-            context="",
+    def full_context(self):
+        """The context together with the summaries of earlier turns, as prompts see it."""
+        return "\n".join(part for part in (self.context, self.summaries.render()) if part)
+
+    def _summarize(self, chunk_actions, chunk_results, cancel=None):
+        """Write the [Previously: ...] summary for some turns. Safe to run on a worker thread."""
+        entries = [val for pair in zip(chunk_actions, chunk_results) for val in pair]
+        # Long turns are shortened rather than letting Ollama cut the prompt off
+        entries = self.generator.fit_passages(entries, self.generator.estimate_tokens(SUMMARIZATION_PROMPT))
+        story_chunk_text = "\n\n".join(entries)
+        return self.generator.generate_raw(
+            story_chunk_text,
+            SUMMARIZATION_PROMPT,
             temperature=0.5,
             generate_num=100,
+            quiet=True,
+            session=self.session_id,
+            cancel=cancel,
         ).strip()
+
+    def _merge_summaries(self, summaries, cancel=None):
+        """Roll several summaries up into one. Safe to run on a worker thread."""
+        texts = self.generator.fit_passages([summary.text for summary in summaries],
+                                            self.generator.estimate_tokens(MERGE_SUMMARIES_PROMPT))
+        return self.generator.generate_raw(
+            "\n\n".join(texts),
+            MERGE_SUMMARIES_PROMPT,
+            temperature=0.5,
+            generate_num=100,
+            quiet=True,
+            session=self.session_id,
+            cancel=cancel,
+        ).strip()
+
+    def _apply_summary(self, summary, chunk_actions, chunk_results):
+        """
+        Replace the oldest turns with their summary. Turns played since the summary
+        was started stay as they are. Returns False if the summarized turns are no
+        longer the oldest ones (e.g. after a revert).
+        """
+        size = len(chunk_actions)
+        if self.actions[:size] != chunk_actions or self.results[:size] != chunk_results:
+            logger.info("Story changed under the summary; discarding it.")
+            return False
+        self.summaries.add(Summary(summary, turns=list(zip(chunk_actions, chunk_results))))
+        self.actions = self.actions[size:]
+        self.results = self.results[size:]
+        logger.info("Story chunk summarized and pruned.")
+        logger.debug(f"New context: {self.full_context()}")
+        return True
+
+    def _apply_merge(self, summary, level, merged):
+        if not self.summaries.merge(level, merged, summary):
+            logger.info("Summaries changed under the merge; discarding it.")
+            return False
+        logger.info(f"Merged {len(merged)} level {level} summaries.")
+        return True
+
+    def start_summary(self):
+        """
+        Once the story is over SUMMARIZE_THRESHOLD turns, start summarizing the oldest
+        STORY_CHUNK_SIZE of them on a worker thread, so no turn waits for it. Otherwise
+        merge summaries that have piled up on one level into one on the next.
+        """
+        if self.pending_summary is not None:
+            return
+        key = self.state_key()
+        if len(self.actions) > self.SUMMARIZE_THRESHOLD:
+            chunk_actions = self.actions[:self.STORY_CHUNK_SIZE]
+            chunk_results = self.results[:self.STORY_CHUNK_SIZE]
+            logger.info("Summarizing the oldest story chunk in the background...")
+            job = BackgroundJob(key, self._summarize, chunk_actions, chunk_results, name="summary")
+            self.pending_summary = (job, lambda text: self._apply_summary(text, chunk_actions, chunk_results))
+            return
+        merge = self.summaries.pending_merge()
+        if merge is not None:
+            level, merged = merge
+            logger.info(f"Merging {len(merged)} level {level} summaries in the background...")
+            job = BackgroundJob(key, self._merge_summaries, merged, name="summary")
+            self.pending_summary = (job, lambda text: self._apply_merge(text, level, merged))
+
+    def finish_summary(self, wait=False):
+        """
+        Swap in the background summary if it is ready (or, with wait=True, once it is).
+        Only called between turns, so the story never changes mid-generation.
+        """
+        if self.pending_summary is None:
+            return
+        job, apply = self.pending_summary
+        if not wait and not job.ready():
+            return
+        self.pending_summary = None
+        summary = job.wait()
         if not summary:
-            logger.warning("Failed to generate story summary. Skipping.")
+            logger.warning("Failed to generate story summary. The next turn will try again.")
             return
-        separator = "\n" if self.context else ""
-        self.context = f"{self.context}{separator}[Previously: {summary}]"
-        self.actions = self.actions[self.STORY_CHUNK_SIZE:]
-        self.results = self.results[self.STORY_CHUNK_SIZE:]
-        logger.info("Story chunk summarized and pruned.")
-        logger.debug(f"New context: {self.context}")
+        apply(summary)
 
-    def act(self, action, record=True, format=True):
-        """Generate the next part of the story based on an action."""
-        assert (self.context.strip() + action.strip())
-        assert (settings.getint('top-keks') is not None)
-        
-        story_so_far = self.get_story()
-        memory_context = ' '.join(self.memory)
-        base_context = f"{self.context} {memory_context}".strip()
+    def cancel_summary(self):
+        if self.pending_summary is not None:
+            self.pending_summary[0].cancel()
+            self.pending_summary = None
+
+    def backlog(self):
+        """How many of the oldest turns compact() would summarize."""
+        excess = len(self.actions) - self.SUMMARIZE_THRESHOLD
+        if excess <= 0:
+            return 0
+        chunks = -(-excess // self.STORY_CHUNK_SIZE)
+        return min(chunks * self.STORY_CHUNK_SIZE, len(self.actions))
+
+    def compact(self, max_workers=3):
+        """
+        Summarize a backlog of turns in one go, e.g. after loading an old or imported
+        save, so the next turn starts at the usual prompt size instead of trimming one
+        chunk per turn. Chunks are summarized `max_workers` at a time, then the
+        summaries are merged level by level the same way. Ctrl-C stops it with
+        GenerationCancelled, keeping whatever was already folded in.
+        """
+        self.cancel_summary()
+        backlog = self.backlog()
+        if not backlog:
+            return
+        cancel = CancellationToken()
+        size = self.STORY_CHUNK_SIZE
+        chunks = [(self.actions[i:i + size], self.results[i:i + size]) for i in range(0, backlog, size)]
+        logger.info(f"Summarizing {backlog} turns in {len(chunks)} chunks...")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="compact") as pool:
+            try:
+                chunk_cancel = cancel.child()
+                futures = [pool.submit(self._summarize, *chunk, cancel=chunk_cancel) for chunk in chunks]
+                # Fold each summary in once it and all before it are done, so stopping
+                # part way keeps the finished start of the backlog
+                for (chunk_actions, chunk_results), future in zip(chunks, futures):
+                    summary = future.result()
+                    if not summary:
+                        logger.warning("A chunk could not be summarized; play will summarize the rest.")
+                        chunk_cancel.cancel()
+                        break
+                    self._apply_summary(summary, chunk_actions, chunk_results)
+
+                for level in range(SummaryStack.LEVELS):
+                    while True:
+                        groups = self.summaries.merge_groups(level)
+                        if not groups:
+                            break
+                        futures = [pool.submit(self._merge_summaries, group, cancel=cancel) for group in groups]
+                        for group, future in zip(groups, futures):
+                            text = future.result()
+                            if not text:
+                                logger.warning("Could not merge summaries; play will retry.")
+                                cancel.cancel()
+                                return
+                            self._apply_merge(text, level, group)
+            except KeyboardInterrupt:
+                cancel.cancel()
+                raise GenerationCancelled() from None
+            except BaseException:
+                # Don't let the pool wait for requests nobody will read
+                cancel.cancel()
+                raise
+
+    def start_recall_index(self):
+        """Embed the turns recall doesn't know yet on a worker thread, unless that is already running."""
+        if self.recall is None or (self.recall_job is not None and not self.recall_job.ready()):
+            return
+        turns = self.summaries.turns() + list(zip(self.actions, self.results))
+        texts = [turn_text(*turn) for turn in turns]
+        self.recall_job = BackgroundJob(self.state_key(), self.recall.add, texts, name="recall")
 
-        # Add a system prompt to guide the AI's behavior for story generation
-        instructions = GENERATE_PASSAGE_PROMPT
-        full_context = f"[System Prompt: {instructions}]\n\n{base_context}"
+    def select_memory(self, action):
+        """The memory entries to send with `action`: pinned ones, then the most relevant within memory-tokens."""
+        query = "\n".join(self.results[-2:] + [action])
+        return self.memory_ranker.select(self.memory, query, settings.getint("memory-tokens", 256),
+                                         self.generator.count_tokens, self.pinned_memory)
+
+    def recalled(self, action):
+        """The summarized-away turns most relevant to `action`, as memory entries for the prompt."""
+        if self.recall is None:
+            return []
+        candidates = [turn_text(*turn) for turn in self.summaries.turns()]
+        query = "\n".join(self.results[-1:] + [action])
+        try:
+            passages = self.recall.search(query, candidates, settings.getint("recall-k", 3))
+        except (OllamaTransportError, ValueError) as e:
+            logger.warning(f"Recall failed: {e}")
+            return []
+        return [f"[Earlier: {passage}]" for passage in passages]
+
+    def state_key(self):
+        """Fingerprint of everything that goes into a story prompt."""
+        state = json.dumps([self.full_context(), self.memory, self.pinned_memory, self.actions, self.results])
+        return hashlib.sha1(state.encode("utf-8")).hexdigest()
+
+    def _cached_context(self, action, memory):
+        """
+        Return Ollama's context for the current state if the next turn can continue it.
+        The conversation keeps the memory entries of the prompt it started from, so it
+        only fits while `memory`, the selection for this action, is still the same.
+        """
+        if not settings.getboolean("reuse-context", True) or not action.strip():
+            return None
+        tokens, cached_memory = self.kv_contexts.get(self.state_key(), (None, None))
+        if not tokens:
+            return None
+        if cached_memory != memory:
+            logger.debug("Memory selection changed, rebuilding prompt.")
+            return None
+        # Stop chaining once the conversation would overflow the model's window;
+        # rebuilding the prompt from text lets it be trimmed again.
+        if len(tokens) + self.generator.estimate_tokens(action) >= self.generator.max_history_tokens:
+            logger.debug("Cached context is full, rebuilding prompt.")
+            return None
+        return tokens
+
+    def _remember_context(self, tokens, memory):
+        """Store Ollama's context for the current state, dropping the oldest branches."""
+        if not tokens:
+            return
+        key = self.state_key()
+        self.kv_contexts[key] = (tokens, memory)
+        self.kv_contexts.move_to_end(key)
+        while len(self.kv_contexts) > self.KV_CACHE_BRANCHES:
+            self.kv_contexts.popitem(last=False)
+
+    def generate_result(self, action, quiet=False):
+        """
+        Generate the continuation for an action without changing the story.
+        Returns the raw result and the PromptContext to hand back to act() with it.
+        """
+        memory = self.select_memory(action) + self.recalled(action)
+        cached = self._cached_context(action, memory)
+        prompt_context = PromptContext(cached, memory)
+        if cached:
+            # Ollama already holds the story up to here, only the action is new.
+            logger.debug("Continuing from cached Ollama context.")
+            prompt = action
+        else:
+            # Add a system prompt to guide the AI's behavior for story generation
+            instructions = GENERATE_PASSAGE_PROMPT
+            prompt = self.generator.build_prompt(
+                self.full_context(),
+                memory,
+                [val for pair in zip(self.actions, self.results) for val in pair],
+                action,
+                system=f"[System Prompt: {instructions}]"
+            )
         
         result = self.generator.generate(
-            story_so_far + action,
-            full_context,
+            prompt,
             temperature=settings.getfloat('temp'),
             top_p=settings.getfloat('top-p'),
             top_k=settings.getint('top-keks'),
             repetition_penalty=settings.getfloat('rep-pen'),
             repetition_penalty_range=settings.getint('rep-pen-range'),
-            repetition_penalty_slope=settings.getfloat('rep-pen-slope')
+            repetition_penalty_slope=settings.getfloat('rep-pen-slope'),
+            prompt_context=prompt_context,
+            stream=False if quiet else None,
+            quiet=quiet,
+            accept=self._is_fresh,
+            session=self.session_id
         )
+        return result, prompt_context
+
+    def _is_fresh(self, result, threshold=0.9):
+        """False for a result so close to the last one that is_looping() would trip on it."""
+        # An empty result (e.g. a failed opening) is similar to everything; compare with real text
+        last = next((previous for previous in reversed(self.results) if previous), None)
+        return last is None or get_similarity(format_input(result), last) <= threshold
+
+    def act(self, action, record=True, format=True, generated=None):
+        """
+        Generate the next part of the story based on an action.
+        `generated` is a (result, prompt_context) pair from generate_result() made
+        ahead of time for this same story state; it is used instead of generating.
+        """
+        assert (self.context.strip() + action.strip())
+        assert (settings.getint('top-keks') is not None)
+
+        if generated is None:
+            generated = self.generate_result(action)
+        result, prompt_context = generated
         
         self.find_and_update_inventory(result)
         if "!" in action:
@@ -91,8 +353,15 @@ class Story:
         if record:
             self.actions.append(format_input(action))
             self.results.append(format_input(result))
-            if len(self.actions) > self.SUMMARIZE_THRESHOLD:
-                self.summarize_chunk()
+            # Ollama's context ends with the raw generation; continuing from it is only
+            # right if that is what the story recorded, not a cut or cleaned up version
+            if prompt_context.text is not None and format_input(prompt_context.text) == self.results[-1]:
+                self._remember_context(prompt_context.returned, prompt_context.memory)
+            else:
+                self.kv_contexts.pop(self.state_key(), None)
+            self.finish_summary()
+            self.start_summary()
+            self.start_recall_index()
         
         return format_result(result) if format else result
 
@@ -134,38 +403,163 @@ class Story:
         lines = [val for pair in zip(self.actions, self.results) for val in pair]
         return '\n\n'.join(lines)
 
+    def branch(self, drop=0):
+        """
+        A copy of the story without its last `drop` action/result pairs, for generating
+        from an earlier state in the background. Shares the generator and cached contexts.
+        """
+        story = Story(self.generator, self.context, list(self.memory))
+        story.pinned_memory = list(self.pinned_memory)
+        story.memory_ranker = self.memory_ranker
+        keep = len(self.actions) - drop
+        story.actions = self.actions[:keep]
+        story.results = self.results[:keep]
+        story.summaries = self.summaries.copy()
+        story.kv_contexts = self.kv_contexts
+        story.session_id = self.session_id
+        story.recall = self.recall
+        return story
+
     def revert(self):
         """Remove the last action-result pair."""
         self.actions = self.actions[:-1]
         self.results = self.results[:-1]
 
-    def get_suggestion(self, previous_suggestions=None):
+    @staticmethod
+    def _exclusion_prompt(previous_suggestions):
+        if not previous_suggestions:
+            return ""
+        exclusions = "\n".join(f"- {s}" for s in previous_suggestions)
+        return f"\n\nTo ensure variety, do not suggest any of the following actions:\n{exclusions}"
+
+    @staticmethod
+    def _clean_suggestion(suggestion):
+        suggestion = suggestion.strip().replace("You ", "", 1).lstrip(" >!.?")
+        return suggestion if suggestion else None
+
+    def get_suggestion(self, previous_suggestions=None, quiet=False):
         """Generate a creative, context-aware action."""
         story_so_far = self.get_story()
-        
-        exclusion_prompt = ""
-        if previous_suggestions:
-            exclusions = "\n".join(f"- {s}" for s in previous_suggestions)
-            exclusion_prompt = f"\n\nTo ensure variety, do not suggest any of the following actions:\n{exclusions}"
+        exclusion_prompt = self._exclusion_prompt(previous_suggestions)
 
         # MODIFIED: A much more direct and powerful prompt.
         suggestion_prompt = (
-            f"Here is the current scene from a text adventure game:\n\n{story_so_far}\n\n" + GENERATE_SUGGESTION_PROMPT + "{exclusion_prompt}"
+            f"Here is the current scene from a text adventure game:\n\n{story_so_far}\n\n" + GENERATE_SUGGESTION_PROMPT + exclusion_prompt
         )
         
         suggestion = self.generator.generate_raw(
             suggestion_prompt,
-            self.context,
+            self.full_context(),
             generate_num=15,
             temperature=settings.getfloat('action-temp'),
             top_p=settings.getfloat('top-p'),
             top_k=settings.getint('top-keks'),
             repetition_penalty=1.2,
-            stop_tokens=["\n", "."]
+            stop_tokens=["\n", "."],
+            quiet=quiet,
+            session=self.session_id
         )
         
-        suggestion = suggestion.strip().replace("You ", "", 1).lstrip(" >!.?")
-        return suggestion if suggestion else None
+        return self._clean_suggestion(suggestion)
+
+    def get_suggestion_list(self, count, previous_suggestions=None, quiet=False):
+        """
+        Ask for `count` actions in a single request, constrained to a JSON schema.
+        Returns None when the model's answer can't be parsed.
+        """
+        story_so_far = self.get_story()
+        schema = {
+            "type": "object",
+            "properties": {
+                "actions": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "minItems": count,
+                    "maxItems": count,
+                }
+            },
+            "required": ["actions"],
+        }
+        suggestion_prompt = (
+            f"Here is the current scene from a text adventure game:\n\n{story_so_far}\n\n"
+            + GENERATE_SUGGESTIONS_PROMPT.format(count=count)
+            + self._exclusion_prompt(previous_suggestions)
+        )
+
+        raw = self.generator.generate_raw(
+            suggestion_prompt,
+            self.full_context(),
+            generate_num=20 * count + 10,
+            temperature=settings.getfloat('action-temp'),
+            top_p=settings.getfloat('top-p'),
+            top_k=settings.getint('top-keks'),
+            repetition_penalty=1.2,
+            quiet=quiet,
+            format=schema,
+            session=self.session_id
+        )
+
+        try:
+            actions = json.loads(raw)["actions"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.info(f"Could not parse suggestion list ({e}): {repr(raw)}")
+            return None
+        if not isinstance(actions, list) or not all(isinstance(a, str) for a in actions):
+            logger.info(f"Suggestion list has the wrong shape: {repr(raw)}")
+            return None
+
+        # The per-call mode stops at the first newline or period; trim to match
+        suggestions = [self._clean_suggestion(a.split("\n")[0].split(".")[0]) for a in actions]
+        return [s for s in suggestions if s]
+
+    @staticmethod
+    def _deduplicate(suggestions, accepted, previous_suggestions, similarity):
+        """Append the suggestions that aren't near-duplicates of what is already known."""
+        for suggestion in suggestions:
+            if not suggestion:
+                continue
+            if any(get_similarity(suggestion.lower(), s.lower()) > similarity
+                   for s in previous_suggestions + accepted):
+                logger.debug(f"Dropping near-duplicate suggestion: {suggestion}")
+                continue
+            accepted.append(suggestion)
+
+    def get_suggestions(self, count, previous_suggestions=None, max_workers=3, similarity=0.85, mode="parallel"):
+        """
+        Generate up to `count` AI suggestions.
+        In "json" mode they are requested together in one structured-output call,
+        falling back to separate calls only if that answer can't be parsed.
+        Separate calls run concurrently, at most `max_workers` at a time, and a second
+        round tops up whatever the duplicate check threw away.
+        """
+        previous_suggestions = list(previous_suggestions or [])
+        accepted = []
+
+        if mode == "json":
+            suggestions = self.get_suggestion_list(count, previous_suggestions, quiet=True)
+            if suggestions is not None:
+                self._deduplicate(suggestions, accepted, previous_suggestions, similarity)
+                return accepted[:count]
+            logger.info("Falling back to one request per suggestion.")
+
+        for _ in range(2):
+            missing = count - len(accepted)
+            if missing <= 0:
+                break
+            known = previous_suggestions + accepted
+            parent = current_token()
+            cancel = parent.child() if parent is not None else CancellationToken()
+            with ThreadPoolExecutor(max_workers=max(1, min(missing, max_workers))) as pool:
+                get_suggestion = with_current_token(self.get_suggestion, cancel)
+                futures = [pool.submit(get_suggestion, known, True) for _ in range(missing)]
+                try:
+                    results = [f.result() for f in futures]
+                except BaseException:
+                    # Don't let the pool wait for suggestions nobody will read
+                    cancel.cancel()
+                    raise
+            self._deduplicate(results, accepted, previous_suggestions, similarity)
+        return accepted[:count]
 
 
     def __str__(self):
@@ -182,9 +576,12 @@ class Story:
         res["rep-pen-slope"] = settings.getfloat("rep-pen-slope")
         res["context"] = self.context
         res["memory"] = self.memory
+        res["pinned_memory"] = self.pinned_memory
         res["actions"] = self.actions
         res["results"] = self.results
+        res["summaries"] = self.summaries.to_dict()
         res["character_sheet"] = self.character.to_dict()
+        res["session_id"] = self.session_id
         if hasattr(self.generator, 'model_name'):
             res["model_name"] = self.generator.model_name
             res["ollama_host"] = self.generator.ollama_host
@@ -203,12 +600,21 @@ class Story:
             settings["rep-pen-range"] = "512"
             settings["rep-pen-slope"] = "3.33"
         
+        self.cancel_summary()
         self.context = d["context"]
         self.memory = d["memory"]
+        self.pinned_memory = d.get("pinned_memory", [])
         self.actions = d["actions"]
         self.results = d["results"]
+        if "summaries" in d:
+            self.summaries = SummaryStack.from_dict(d["summaries"])
+        else:
+            # Older saves kept their summaries in the context; let them merge like new ones
+            self.context, self.summaries = SummaryStack.from_context(self.context)
         if "character_sheet" in d:
             self.character.from_dict(d["character_sheet"])
+        # Keep the saved session so a reloaded story goes back to the same host
+        self.session_id = d.get("session_id", self.session_id)
 
     def to_json(self):
         """Convert story to JSON string."""
@@ -220,7 +626,8 @@ class Story:
 
     def is_looping(self, threshold=0.9):
         """Check if the AI is generating repetitive content."""
-        if len(self.results) >= 2:
+        # Following an empty result (a failed turn) is not a repeat of it
+        if len(self.results) >= 2 and self.results[-2]:
             similarity = get_similarity(self.results[-1], self.results[-2])
             if similarity > threshold:
                 return True
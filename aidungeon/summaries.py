@@ -0,0 +1,138 @@
+# aidungeon/summaries.py
+from typing import List, Optional, Tuple
+
+
+class Summary:
+    """
+    One [Previously: ...] summary. A first-level summary keeps the (action, result)
+    turns it replaced; a higher-level one keeps the summaries it merged, so the
+    whole story can still be drilled down into from the save file.
+    """
+
+    def __init__(self, text: str, level: int = 0, turns: Optional[List[Tuple[str, str]]] = None,
+                 children: Optional[List["Summary"]] = None):
+        self.text = text
+        self.level = level
+        self.turns = turns or []
+        self.children = children or []
+
+    def to_dict(self):
+        d = {"text": self.text, "level": self.level}
+        if self.turns:
+            d["turns"] = [list(turn) for turn in self.turns]
+        if self.children:
+            d["children"] = [child.to_dict() for child in self.children]
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["text"], d.get("level", 0),
+                   turns=[tuple(turn) for turn in d.get("turns", [])],
+                   children=[cls.from_dict(child) for child in d.get("children", [])])
+
+
+class SummaryStack:
+    """
+    The summaries currently standing in for old turns, by level. Whenever a level
+    holds MERGE_COUNT summaries they are merged into one on the next level up; the
+    top level merges into itself. At most LEVELS * (MERGE_COUNT - 1) summaries are
+    ever active, so however long a campaign runs, the summaries sent with every
+    prompt stay within a fixed size.
+    """
+
+    MERGE_COUNT = 3
+    LEVELS = 3
+
+    def __init__(self):
+        self.levels = [[] for _ in range(self.LEVELS)]
+
+    def copy(self) -> "SummaryStack":
+        stack = SummaryStack()
+        stack.levels = [list(level) for level in self.levels]
+        return stack
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def active(self) -> List[Summary]:
+        """Active summaries in story order: the oldest (highest level) first."""
+        return [summary for level in reversed(self.levels) for summary in level]
+
+    def render(self) -> str:
+        return "\n".join(f"[Previously: {summary.text}]" for summary in self.active())
+
+    def turns(self) -> List[Tuple[str, str]]:
+        """Every (action, result) turn the active summaries stand in for, in story order."""
+        turns = []
+        pending = list(reversed(self.active()))
+        while pending:
+            summary = pending.pop()
+            turns.extend(summary.turns)
+            pending.extend(reversed(summary.children))
+        return turns
+
+    def add(self, summary: Summary):
+        self.levels[0].append(summary)
+
+    def pending_merge(self) -> Optional[Tuple[int, List[Summary]]]:
+        """The (level, summaries) due to be merged next, lowest level first, if any."""
+        for level, summaries in enumerate(self.levels):
+            if len(summaries) >= self.MERGE_COUNT:
+                return level, summaries[:self.MERGE_COUNT]
+        return None
+
+    def merge_groups(self, level: int) -> List[List[Summary]]:
+        """
+        Every full MERGE_COUNT group on a level below the top, oldest first. Merging them
+        in that order keeps the story in order; the top level can only merge one at a time.
+        """
+        if level >= self.LEVELS - 1:
+            merge = self.pending_merge()
+            return [merge[1]] if merge and merge[0] == level else []
+        summaries = self.levels[level]
+        full = len(summaries) - len(summaries) % self.MERGE_COUNT
+        return [summaries[i:i + self.MERGE_COUNT] for i in range(0, full, self.MERGE_COUNT)]
+
+    def merge(self, level: int, summaries: List[Summary], text: str) -> bool:
+        """
+        Replace `summaries`, the oldest ones on `level`, with one summary `text`.
+        Returns False if they aren't the oldest on that level any more.
+        """
+        current = self.levels[level][:len(summaries)]
+        if len(current) != len(summaries) or any(a is not b for a, b in zip(current, summaries)):
+            return False
+        target = min(level + 1, self.LEVELS - 1)
+        merged = Summary(text, target, children=summaries)
+        del self.levels[level][:len(summaries)]
+        if target == level:
+            # The top level rolls up into itself, oldest first
+            self.levels[target].insert(0, merged)
+        else:
+            self.levels[target].append(merged)
+        return True
+
+    def to_dict(self):
+        return [[summary.to_dict() for summary in level] for level in self.levels]
+
+    @classmethod
+    def from_dict(cls, d):
+        stack = cls()
+        for i, level in enumerate(d[:cls.LEVELS]):
+            stack.levels[i] = [Summary.from_dict(summary) for summary in level]
+        return stack
+
+    @classmethod
+    def from_context(cls, context: str) -> Tuple[str, "SummaryStack"]:
+        """
+        Split the [Previously: ...] lines older saves appended to the context off its
+        end. Returns the bare context and a stack holding them as level-0 summaries.
+        """
+        stack = cls()
+        marker = "[Previously: "
+        while context.endswith("]"):
+            start = context.rfind(marker)
+            if start < 0 or (start > 0 and context[start - 1] != "\n"):
+                break
+            stack.levels[0].insert(0, Summary(context[start + len(marker):-1]))
+            context = context[:max(start - 1, 0)]
+        return context, stack
@@ -0,0 +1,86 @@
+# aidungeon/tokens.py
+import json
+import math
+import threading
+from pathlib import Path
+from .getconfig import logger
+
+CACHE_FILE = Path(".cache", "token_ratios.json")
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+
+class TokenEstimator:
+    """
+    Estimates token counts from text length, using a characters-per-token ratio
+    learned for each model from the prompt_eval_count/eval_count Ollama reports.
+    The ratio is kept on disk so a new session starts out calibrated.
+    """
+
+    # Samples smaller than this are mostly template and stop-token noise
+    MIN_SAMPLE_TOKENS = 16
+    SMOOTHING = 0.2
+    SAVE_EVERY = 10
+
+    def __init__(self, model_name: str, path: Path = CACHE_FILE):
+        self.model_name = model_name
+        self.path = path
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN
+        # Bumped whenever the ratio moves enough for cached counts to be worth redoing
+        self.version = 0
+        self._counted_ratio = self.chars_per_token
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        ratios = self._load()
+        if model_name in ratios:
+            self.chars_per_token = float(ratios[model_name])
+            self._counted_ratio = self.chars_per_token
+            logger.debug(f"Loaded {self.chars_per_token:.2f} chars/token for {model_name}")
+
+    def _load(self) -> dict:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (IOError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token ratio cache {self.path}: {e}")
+            return {}
+
+    def save(self):
+        with self._lock:
+            ratios = self._load()
+            ratios[self.model_name] = round(self.chars_per_token, 4)
+            self._unsaved = 0
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with self.path.open("w", encoding="utf-8") as f:
+                    json.dump(ratios, f, indent=1)
+            except IOError as e:
+                logger.warning(f"Could not write token ratio cache {self.path}: {e}")
+
+    def flush(self):
+        """Save the ratio if it learned anything since the last save."""
+        if self._unsaved:
+            self.save()
+
+    def estimate_tokens(self, text: str) -> int:
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def observe(self, chars: int, tokens: int):
+        """Fold one measured (characters, tokens) pair into the ratio."""
+        if not tokens or tokens < self.MIN_SAMPLE_TOKENS or chars <= 0:
+            return
+        sample = min(max(chars / tokens, 1.0), 10.0)
+        with self._lock:
+            self.chars_per_token += (sample - self.chars_per_token) * self.SMOOTHING
+            if abs(self.chars_per_token - self._counted_ratio) / self._counted_ratio > 0.05:
+                self._counted_ratio = self.chars_per_token
+                self.version += 1
+            self._unsaved += 1
+            save = self._unsaved >= self.SAVE_EVERY
+        logger.debug(f"Token ratio sample {sample:.2f}, now {self.chars_per_token:.2f} chars/token")
+        if save:
+            self.save()
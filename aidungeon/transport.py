@@ -0,0 +1,529 @@
+# aidungeon/transport.py
+import bisect
+import hashlib
+import itertools
+import math
+import socket
+import threading
+from typing import List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool, PoolManager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+from .getconfig import settings, logger, get_ollama_timeout
+from .background import current_token
+
+
+class Timeouts:
+    """
+    How long requests to Ollama may take, in seconds: to connect, until the first
+    bytes of the reply arrive (for a streamed generation, the first token, which
+    includes loading the model), and for a whole generation.
+    """
+
+    def __init__(self, connect: float = 5.0, first_token: float = 90.0, total: float = 180.0):
+        self.connect = connect
+        self.first_token = first_token
+        self.total = total
+
+    def for_request(self, total: Optional[float] = None) -> tuple:
+        """A requests (connect, read) timeout; the read part never outlasts the total."""
+        total = min(total, self.total) if total else self.total
+        return self.connect, min(self.first_token, total)
+
+
+def get_timeouts() -> Timeouts:
+    """Timeouts configured from the settings file."""
+    return Timeouts(
+        connect=settings.getfloat("ollama-connect-timeout", 5),
+        first_token=settings.getfloat("ollama-first-token-timeout", 90),
+        total=float(get_ollama_timeout()),
+    )
+
+
+class _ConnectionAbort:
+    """Registered with a CancellationToken: closing it aborts the connection's pending read."""
+
+    def __init__(self, connection: HTTPConnection):
+        self.connection = connection
+
+    def close(self):
+        sock = self.connection.sock
+        if sock is not None:
+            try:
+                # Unlike close(), shutdown() wakes a thread blocked reading the socket
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _CancellableConnection(HTTPConnection):
+    """
+    A connection the requesting thread's CancellationToken (see current_token) can
+    abort until the response headers arrive. Ollama sends none until the model is
+    loaded, and a streamed response only registers with the token once it exists.
+    """
+
+    _token = None
+
+    def request(self, *args, **kwargs):
+        token = current_token()
+        if token is not None:
+            self._abort = _ConnectionAbort(self)
+            token.register(self._abort)
+            self._token = token
+        try:
+            return super().request(*args, **kwargs)
+        except BaseException:
+            self._release_token()
+            raise
+
+    def getresponse(self, *args, **kwargs):
+        try:
+            return super().getresponse(*args, **kwargs)
+        finally:
+            self._release_token()
+
+    def _release_token(self):
+        if self._token is not None:
+            self._token.unregister(self._abort)
+            self._token = None
+
+
+class _CancellableHTTPSConnection(_CancellableConnection, HTTPSConnection):
+    pass
+
+
+class _BoundedPool(HTTPConnectionPool):
+    """
+    A connection pool that waits at most `pool_timeout` seconds for a free connection
+    by default, and whose requests can be cancelled before the response arrives.
+    """
+
+    ConnectionCls = _CancellableConnection
+    pool_timeout = None
+
+    def urlopen(self, *args, **kwargs):
+        if kwargs.get("pool_timeout") is None:
+            kwargs["pool_timeout"] = self.pool_timeout
+        return super().urlopen(*args, **kwargs)
+
+
+class _BoundedHTTPSPool(_BoundedPool, HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+class _BoundedPoolManager(PoolManager):
+    """A PoolManager whose blocking pools wait at most `pool_timeout` seconds for a free connection."""
+
+    def __init__(self, pool_timeout: Optional[float] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_timeout = pool_timeout
+        self.pool_classes_by_scheme = {"http": _BoundedPool, "https": _BoundedHTTPSPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.pool_timeout = self.pool_timeout
+        return pool
+
+
+class BoundedPoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter for blocking pools that gives up waiting for a free connection after
+    `pool_timeout` seconds, raising requests' Timeout, instead of hanging forever
+    when every connection is taken.
+    """
+
+    def __init__(self, pool_timeout: Optional[float] = None, **kwargs):
+        self.pool_timeout = pool_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _BoundedPoolManager(
+            self.pool_timeout, num_pools=connections, maxsize=maxsize, block=block, **pool_kwargs
+        )
+
+    def send(self, request, **kwargs):
+        try:
+            return super().send(request, **kwargs)
+        except EmptyPoolError as e:
+            raise requests.exceptions.Timeout(
+                f"No free connection to {request.url} after {self.pool_timeout}s", request=request
+            ) from e
+
+
+class OllamaTransport:
+    """
+    Pooled keep-alive HTTP transport for talking to an Ollama server.
+    Every request made by the generator goes through the same session so
+    connections are reused between story turns, suggestions and summaries.
+    """
+
+    def __init__(
+            self,
+            ollama_host: str = "http://localhost:11434",
+            pool_size: int = 2,
+            pool_maxsize: int = 8,
+            retries: int = 2,
+            backoff: float = 0.3,
+            timeouts: Optional[Timeouts] = None
+    ):
+        self.ollama_host = ollama_host.rstrip('/')
+        self.timeouts = timeouts if timeouts is not None else Timeouts()
+        self.session = requests.Session()
+
+        # Only connection failures and "server busy" statuses are retried here.
+        # A read failure on /api/generate means the model may already be working,
+        # so replaying it at this level would just pile up duplicate generations.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        # pool_block keeps the number of sockets per host at pool_maxsize
+        # instead of opening throwaway connections when the pool is busy.
+        # Waiting for a free one counts towards the first token.
+        adapter = BoundedPoolAdapter(
+            pool_timeout=self.timeouts.first_token,
+            pool_connections=pool_size,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=True,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        logger.debug(f"Created Ollama transport for {self.ollama_host} "
+                     f"(pools={pool_size}, per-host={pool_maxsize}, retries={retries})")
+
+    def url(self, path: str) -> str:
+        return f"{self.ollama_host}/{path.lstrip('/')}"
+
+    def hosts(self) -> List["OllamaTransport"]:
+        """The single-host transports behind this one, for requests every host should get."""
+        return [self]
+
+    def require_model(self, model_name: str):
+        """Routing hint for HostPool; a single host has nowhere else to send requests."""
+
+    def can_fail_over(self) -> bool:
+        """Whether a failing request has a healthy host to go to instead. Never for a single host."""
+        return False
+
+    # `session` and `hedge` are HostPool's routing hints; with one host everything goes here anyway
+    def get(self, path: str, session: Optional[str] = None, hedge: bool = False, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeouts.for_request())
+        return self.session.get(self.url(path), **kwargs)
+
+    def post(self, path: str, session: Optional[str] = None, hedge: bool = False, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeouts.for_request())
+        return self.session.post(self.url(path), **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class HostState:
+    """What a HostPool knows about one Ollama server."""
+
+    def __init__(self, transport: OllamaTransport):
+        self.transport = transport
+        self.healthy = True
+        # Model names from the last health check; None until the first one finishes
+        self.models = None
+        self.in_flight = 0
+        self.failures = 0
+
+    def serves(self, model_name: Optional[str]) -> bool:
+        return model_name is None or self.models is None or model_name in self.models
+
+    def to_dict(self) -> dict:
+        return {"host": self.transport.ollama_host, "healthy": self.healthy,
+                "in_flight": self.in_flight, "models": len(self.models) if self.models is not None else None}
+
+
+class HostPool:
+    """
+    Spreads requests over several Ollama servers. Each request goes to the healthy
+    host with the fewest requests in flight that has the model; a host that refuses
+    the connection is marked down and the request moves on to the next one, so a
+    node restart costs a failover instead of the game. A daemon thread re-checks
+    every host's /api/tags every `health_interval` seconds, bringing recovered hosts
+    back and keeping track of which models each one has.
+
+    Requests that carry a `session` key (a story's session_id) are routed by
+    consistent hashing instead, so a story keeps hitting the node that holds its
+    prompt in the KV cache. A session only leaves its node while that node is down
+    (it then sticks to the replacement, whose cache is now the warm one) or, for a
+    single request, while the node has `max_in_flight` requests running. Sessions
+    displaced by an outage drift back a few per health check once the node
+    recovers, rather than all stampeding back at once. A `hedge` request, the
+    backup copy of one that is stalling, goes to the session's next node instead.
+
+    Offers the same get/post interface as OllamaTransport, so the generator and
+    Discovery don't need to know whether they talk to one server or many.
+    """
+
+    # Statuses that mean "this host can't take it right now", worth trying elsewhere
+    BUSY_STATUSES = (502, 503, 504)
+    # Points per host on the hash ring; more points spread sessions more evenly
+    VIRTUAL_NODES = 64
+    # Share of displaced sessions allowed back to their home node per health check
+    REBALANCE_FRACTION = 0.25
+
+    def __init__(self, transports: List[OllamaTransport], health_interval: float = 15.0,
+                 max_in_flight: int = 4):
+        self.states = [HostState(transport) for transport in transports]
+        self.timeouts = transports[0].timeouts
+        self.ollama_host = ",".join(transport.ollama_host for transport in transports)
+        self.model_name = None
+        self.health_interval = health_interval
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._rotation = itertools.count()
+        self._ring = sorted((
+            (self._hash(f"{state.transport.ollama_host}#{i}"), state)
+            for state in self.states for i in range(self.VIRTUAL_NODES)
+        ), key=lambda point: point[0])
+        self._ring_keys = [point for point, _ in self._ring]
+        # session -> the host it is currently pinned to
+        self._assigned = {}
+        self._rebalance_budget = 0
+        self._stop = threading.Event()
+        self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+    def _preference(self, session: str) -> List[HostState]:
+        """Every host, in the order the hash ring prefers them for this session."""
+        start = bisect.bisect(self._ring_keys, self._hash(session))
+        order = []
+        for i in range(len(self._ring)):
+            state = self._ring[(start + i) % len(self._ring)][1]
+            if state not in order:
+                order.append(state)
+                if len(order) == len(self.states):
+                    break
+        return order
+
+    def require_model(self, model_name: str):
+        """Only route to hosts that have this model, once their health check says so."""
+        self.model_name = model_name
+
+    def hosts(self) -> List[OllamaTransport]:
+        return [state.transport for state in self.states]
+
+    def can_fail_over(self) -> bool:
+        with self._lock:
+            return any(self._usable(state) for state in self.states)
+
+    def status(self) -> List[dict]:
+        with self._lock:
+            return [state.to_dict() for state in self.states]
+
+    def check_health(self):
+        """Ask every host for its model list and update which ones are up."""
+        for state in self.states:
+            try:
+                # A health check shouldn't wait for a model load: connect timeout throughout
+                connect = state.transport.timeouts.connect
+                response = state.transport.get("/api/tags", timeout=(connect, connect))
+                response.raise_for_status()
+                models = {model['name'] for model in response.json().get('models', [])}
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._mark_down(state, e)
+                continue
+            with self._lock:
+                if not state.healthy:
+                    logger.info(f"Ollama host {state.transport.ollama_host} is back up.")
+                state.healthy = True
+                state.failures = 0
+                state.models = models
+            if self.model_name and self.model_name not in models:
+                logger.warning(f"Ollama host {state.transport.ollama_host} does not have {self.model_name}.")
+        self._refill_rebalance_budget()
+
+    def _usable(self, state: HostState) -> bool:
+        return state.healthy and state.serves(self.model_name)
+
+    def _refill_rebalance_budget(self):
+        with self._lock:
+            displaced = sum(
+                1 for session, state in self._assigned.items()
+                if state is not next((s for s in self._preference(session) if self._usable(s)), state)
+            )
+            self._rebalance_budget = math.ceil(displaced * self.REBALANCE_FRACTION)
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self.health_interval)
+
+    def _mark_down(self, state: HostState, error: Exception):
+        with self._lock:
+            if state.healthy:
+                logger.warning(f"Ollama host {state.transport.ollama_host} is down: {error}")
+            state.healthy = False
+            state.failures += 1
+
+    def _pick(self, tried: set, session: Optional[str] = None, hedge: bool = False) -> Optional[HostState]:
+        """
+        The host for the next try: the session's node if there is a session, otherwise
+        the least loaded healthy host not tried yet; failing that, any untried host.
+        """
+        with self._lock:
+            candidates = [state for state in self.states if state not in tried]
+            if not candidates:
+                return None
+            usable = [state for state in candidates if self._usable(state)]
+            if session is not None and usable:
+                state = self._pick_for_session(session, usable, hedge)
+                state.in_flight += 1
+                return state
+            # Everything looks down: try anyway rather than fail without asking
+            pool = usable or sorted(candidates, key=lambda state: state.failures)[:1]
+            # Rotate the starting point so equally loaded hosts take turns
+            offset = next(self._rotation) % len(pool)
+            pool = pool[offset:] + pool[:offset]
+            state = min(pool, key=lambda state: state.in_flight)
+            state.in_flight += 1
+            return state
+
+    def _pick_for_session(self, session: str, usable: List[HostState], hedge: bool = False) -> HostState:
+        """Called with the lock held. `usable` is non-empty."""
+        preference = [state for state in self._preference(session) if state in usable]
+        if hedge:
+            # Anywhere but the node the stalled original went to, without moving the session
+            pinned = self._assigned.get(session)
+            return next((state for state in preference if state is not pinned), preference[0])
+        home = preference[0]
+        current = self._assigned.get(session)
+        if current in usable and current is not home:
+            # Displaced earlier; go back home only when this check's budget allows
+            if self._rebalance_budget > 0:
+                self._rebalance_budget -= 1
+                logger.debug(f"Moving session {session[:8]} back to {home.transport.ollama_host}")
+                current = home
+        elif current is not home:
+            if current is not None:
+                logger.info(f"Session {session[:8]} moves from {current.transport.ollama_host} "
+                            f"to {home.transport.ollama_host}")
+            current = home
+        self._assigned[session] = current
+
+        if self.max_in_flight > 0 and current.in_flight >= self.max_in_flight:
+            # Busy: lend this one request to the next node without moving the session
+            spill = next((state for state in preference if state.in_flight < self.max_in_flight), None)
+            if spill is not None:
+                return spill
+        return current
+
+    def _release(self, state: HostState):
+        with self._lock:
+            state.in_flight -= 1
+
+    def _track_stream(self, state: HostState, response: requests.Response):
+        """Keep a streamed request counted as in flight until its response is closed."""
+        close = response.close
+        released = threading.Event()
+
+        def close_and_release():
+            if not released.is_set():
+                released.set()
+                self._release(state)
+            close()
+
+        response.close = close_and_release
+
+    def request(self, method: str, path: str, session: Optional[str] = None, hedge: bool = False,
+                **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeouts.for_request())
+        tried = set()
+        error = None
+        response = None
+        while True:
+            state = self._pick(tried, session, hedge)
+            if state is None:
+                break
+            tried.add(state)
+            try:
+                response = state.transport.session.request(method, state.transport.url(path), **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self._release(state)
+                token = current_token()
+                if token is not None and token.cancelled:
+                    # Aborted on purpose; the host is fine
+                    raise
+                # Nothing reached the model, so the request can safely go elsewhere
+                self._mark_down(state, e)
+                error = e
+                continue
+            except Exception:
+                self._release(state)
+                raise
+            if response.status_code in self.BUSY_STATUSES and len(tried) < len(self.states):
+                logger.info(f"Ollama host {state.transport.ollama_host} answered {response.status_code}; trying another.")
+                self._release(state)
+                response.close()
+                continue
+            if kwargs.get("stream"):
+                self._track_stream(state, response)
+            else:
+                self._release(state)
+            return response
+        if response is not None:
+            return response
+        raise error
+
+    def get(self, path: str, session: Optional[str] = None, hedge: bool = False, **kwargs) -> requests.Response:
+        return self.request("GET", path, session=session, hedge=hedge, **kwargs)
+
+    def post(self, path: str, session: Optional[str] = None, hedge: bool = False, **kwargs) -> requests.Response:
+        return self.request("POST", path, session=session, hedge=hedge, **kwargs)
+
+    def close(self):
+        self._stop.set()
+        for state in self.states:
+            state.transport.close()
+
+
+def get_transport(ollama_host: str) -> OllamaTransport:
+    """
+    Create a transport configured from the settings file. Several comma separated
+    hosts give a HostPool over all of them.
+    """
+    hosts = [host.strip() for host in ollama_host.split(",") if host.strip()]
+    if len(hosts) > 1:
+        # The pool fails over to the next host itself, so a dead host
+        # shouldn't also be retried at the connection level first.
+        return HostPool(
+            [OllamaTransport(
+                ollama_host=host,
+                pool_size=1,
+                pool_maxsize=settings.getint("ollama-pool-maxsize", 8),
+                retries=0,
+                timeouts=get_timeouts(),
+            ) for host in hosts],
+            health_interval=settings.getfloat("ollama-health-interval", 15),
+            max_in_flight=settings.getint("ollama-host-max-in-flight", 4),
+        )
+    return OllamaTransport(
+        ollama_host=hosts[0] if hosts else ollama_host,
+        pool_size=settings.getint("ollama-pool-size", 2),
+        pool_maxsize=settings.getint("ollama-pool-maxsize", 8),
+        retries=settings.getint("ollama-retries", 2),
+        timeouts=get_timeouts(),
+    )
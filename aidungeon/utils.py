@@ -60,6 +60,11 @@ def clear_lines(n):
         print(screen_code, end="\r")
 
 
+def count_rows(text):
+    """Number of terminal rows unwrapped text takes up once the terminal wraps it."""
+    return sum(max(1, -(-len(line) // termWidth)) for line in text.split('\n'))
+
+
 if in_colab():
     logger.warning("Colab mode enabled, disabling line clearing and readline to avoid colab bugs.")
 else: